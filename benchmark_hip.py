@@ -0,0 +1,238 @@
+"""Benchmark suite for the HIP pipeline on synthetic BRON exports.
+
+For every scale a synthetic export is generated (see generate_synthetic_bron.py) and the following steps are timed:
+    - import_data: the full csv import, and the streaming import with a chunksize
+    - build_indexes: building the lookup indexes of HIPData
+    - retrieve_accident_by_ID / find_road_segment: single lookups, including the creation of the Accident objects
+    - find_accidents_on_roadsegment / retrieve_road_segment_by_ID: per-segment queries
+    - find_accidents_within_radius: building the spatial index and radius queries of 2 km around accidents
+    - assess_all / plan_inspections: the bulk assessment and the network-wide planning
+For every step the duration (best of the repeats), the throughput and the peak memory (traced with tracemalloc
+in a separate run) are reported. The results can be stored as a baseline, later runs are then compared against
+it and steps that became slower or use more memory than the tolerance are reported as regressions.
+Before the timings, the results of assess_all are checked against Accident.assesment_task_assess_damage_level
+on a sample of accidents, and the parallel assess_all and segment_aggregates against their serial results.
+A difference is reported as a regression as well.
+
+Usage:
+    python benchmark_hip.py --scales 1 10 --save-baseline
+    python benchmark_hip.py --scales 1 10"""
+import argparse
+import json
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from tabulate import tabulate
+
+import highway_inspection_planning as HIP
+import generate_synthetic_bron
+
+default_baseline_filename = 'benchmark_baseline.json'
+default_data_foldername = 'synthetic_bron'
+#Number of random IDs used in the lookup benchmarks
+n_lookups = 200
+#Number of random accidents of which the bulk assessment is compared to the per-object assessment
+n_equivalence_accidents = 500
+#Number of processes used to compare the parallel results to the serial results
+n_equivalence_processes = 2
+#Relative slowdown (or memory increase) compared to the baseline that is reported as a regression
+default_tolerance = 0.25
+
+def benchmark_steps(foldername, n_lookups=n_lookups, seed=0):
+    """Returns the benchmark steps for the export in foldername as a list of (name, function) tuples.
+       Every function returns the number of processed items, which is used for the throughput.
+       The steps share their state (the imported data), so they have to be run in order"""
+    state = {}
+    rng = np.random.default_rng(seed)
+
+    def import_full():
+        state['data'] = HIP.prepare_data(HIP.import_data(foldername))
+        accidents, parties, roadsegments, ref_files = state['data']
+        state['accident_IDs'] = rng.choice(accidents.index.to_numpy(), min(n_lookups, len(accidents)), replace=False)
+        state['roadsegment_IDs'] = rng.choice(accidents['WVK_ID'].dropna().unique().astype(int), min(n_lookups, accidents['WVK_ID'].nunique()), replace=False)
+        return len(accidents) + len(parties) + len(roadsegments)
+
+    def import_streaming():
+        accidents, parties, roadsegments, ref_files = HIP.import_data(foldername, chunksize=100000)
+        return len(accidents) + len(parties) + len(roadsegments)
+
+    def build_indexes():
+        state['data'].indexes = {}
+        state['data'].build_indexes()
+        return len(state['data'][0]) + len(state['data'][1]) + len(state['data'][2])
+
+    def retrieve_accidents():
+        for accident_ID in state['accident_IDs']:
+            HIP.retrieve_accident_by_ID(state['data'], accident_ID)
+        return len(state['accident_IDs'])
+
+    def find_road_segments():
+        for roadsegment_ID in state['roadsegment_IDs']:
+            HIP.find_road_segment(state['data'], roadsegment_ID)
+        return len(state['roadsegment_IDs'])
+
+    def find_accidents_on_roadsegments():
+        n_accidents = 0
+        for roadsegment_ID in state['roadsegment_IDs']:
+            n_accidents += len(HIP.find_accidents_on_roadsegment(state['data'], roadsegment_ID))
+        return n_accidents
+
+    def retrieve_road_segments():
+        for roadsegment_ID in state['roadsegment_IDs']:
+            HIP.retrieve_road_segment_by_ID(state['data'], roadsegment_ID)
+        return len(state['roadsegment_IDs'])
+
+    def find_accidents_within_radius():
+        state['data'].indexes.pop('spatial', None)
+        spatial_index = state['data'].get_index('spatial')
+        accident_positions = state['data'][0].index.get_indexer(state['accident_IDs'])
+        n_accidents = 0
+        for x, y in spatial_index.accident_xy[accident_positions]:
+            n_accidents += len(HIP.find_accidents_within_radius(state['data'], x, y, 2000))
+        return n_accidents
+
+    def assess_all():
+        state['assessment'] = HIP.assess_all(state['data'])
+        return len(state['assessment'])
+
+    def plan_inspections():
+        return len(HIP.plan_inspections(state['data'], assessment=state['assessment']))
+
+    return [('import_data', import_full), ('import_data_streaming', import_streaming), ('build_indexes', build_indexes),
+            ('retrieve_accident_by_ID', retrieve_accidents), ('find_road_segment', find_road_segments),
+            ('find_accidents_on_roadsegment', find_accidents_on_roadsegments), ('retrieve_road_segment_by_ID', retrieve_road_segments),
+            ('find_accidents_within_radius', find_accidents_within_radius),
+            ('assess_all', assess_all), ('plan_inspections', plan_inspections)]
+
+def run_benchmarks(foldername, repeat=3, measure_memory=True):
+    """Runs all benchmark steps on the export in foldername.
+       Returns a dictionary with per step the duration in seconds, the throughput in items per second and the peak memory in MB"""
+    results = {}
+    timings = {}
+    for i in range(repeat):
+        for name, step in benchmark_steps(foldername):
+            start = time.perf_counter()
+            n_items = step()
+            timings.setdefault(name, []).append((time.perf_counter() - start, n_items))
+    for name, runs in timings.items():
+        seconds, n_items = min(runs)
+        results[name] = {'seconds': seconds, 'items': n_items, 'throughput': n_items / seconds if seconds > 0 else float('inf')}
+
+    if measure_memory:
+        #Tracing slows down the steps, so the memory is measured in a separate run
+        tracemalloc.start()
+        for name, step in benchmark_steps(foldername):
+            tracemalloc.reset_peak()
+            baseline_memory = tracemalloc.get_traced_memory()[0]
+            step()
+            results[name]['peak_mb'] = (tracemalloc.get_traced_memory()[1] - baseline_memory) / 2**20
+        tracemalloc.stop()
+    return results
+
+def check_equivalence(foldername, n_accidents=n_equivalence_accidents, seed=0):
+    """Checks that assess_all gives the same abstractions and expected damage level as the per-object Accident assesment
+       on a random sample of n_accidents accidents of the export in foldername.
+       Returns a list with a description of every difference, which is empty if all results are the same"""
+    data = HIP.prepare_data(HIP.import_data(foldername))
+    accidents, parties, roadsegments, ref_files = data
+    differences = []
+    assessment = HIP.assess_all(data)
+
+    rng = np.random.default_rng(seed)
+    positions = rng.choice(len(accidents), min(n_accidents, len(accidents)), replace=False)
+    attributes = ['n_parties'] + list(HIP.abstraction_attributes) + ['expected_damage_level']
+    for position in np.sort(positions):
+        accident = HIP.Accident.from_position(data, position)
+        accident.assesment_task_assess_damage_level()
+        bulk = assessment.iloc[position]
+        for attribute in attributes:
+            if getattr(accident, attribute) != bulk[attribute]:
+                differences.append(f'assess_all: {attribute} of accident {accident.ID} is {bulk[attribute]}, the Accident object gives {getattr(accident, attribute)}')
+    return differences
+
+def check_parallel_equivalence(foldername, n_processes=n_equivalence_processes):
+    """Checks that assess_all and segment_aggregates with n_processes give exactly the serial result on the export in foldername.
+       Returns a list with a description of every difference, which is empty if all results are the same"""
+    data = HIP.prepare_data(HIP.import_data(foldername))
+    differences = []
+    assessment = HIP.assess_all(data)
+    aggregates = HIP.segment_aggregates(data, assessment)
+    for name, serial, parallel in [('assess_all', assessment, lambda: HIP.assess_all(data, n_processes=n_processes)),
+                                   ('segment_aggregates', aggregates, lambda: HIP.segment_aggregates(data, assessment, n_processes=n_processes))]:
+        try:
+            pd.testing.assert_frame_equal(parallel(), serial, check_exact=True)
+        except AssertionError as error:
+            differences.append(f'{name}(n_processes={n_processes}) differs from the serial result: {error}')
+    return differences
+
+def compare_to_baseline(results, baseline, tolerance=default_tolerance):
+    """Compares the results of one scale to the baseline of that scale.
+       Returns the rows of the comparison table and the list of steps that regressed"""
+    rows = []
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name, {})
+        time_ratio = result['seconds'] / reference['seconds'] if reference.get('seconds') else np.nan
+        memory_ratio = result['peak_mb'] / reference['peak_mb'] if reference.get('peak_mb') and 'peak_mb' in result else np.nan
+        regressed = time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+        rows.append([name, result['seconds'], result['throughput'], result.get('peak_mb', np.nan), time_ratio, memory_ratio, 'REGRESSION' if regressed else ''])
+    return rows, regressions
+
+def prepare_synthetic_bron(data_foldername, scale, seed=0):
+    """Generates the synthetic export for a scale, unless it already exists"""
+    foldername = Path(data_foldername, f'scale_{scale:g}')
+    if not Path(foldername, HIP.accident_data_foldername, 'ongevallen.txt').exists():
+        generate_synthetic_bron.generate_bron(foldername, scale, seed=seed)
+    return foldername
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmark the HIP pipeline on synthetic BRON exports')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1], help='scales of the synthetic exports, e.g. 1 10 100')
+    parser.add_argument('--data-folder', default=default_data_foldername, help='folder for the synthetic exports')
+    parser.add_argument('--baseline', default=default_baseline_filename, help='json file with the stored baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs, the best run is reported')
+    parser.add_argument('--tolerance', type=float, default=default_tolerance)
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory measurement')
+    parser.add_argument('--no-equivalence', action='store_true', help='skip the comparison with the reference implementations')
+    arguments = parser.parse_args(arguments)
+
+    baseline = json.loads(Path(arguments.baseline).read_text()) if Path(arguments.baseline).exists() else {}
+    all_results = {}
+    all_regressions = []
+    all_differences = []
+    for scale in arguments.scales:
+        foldername = prepare_synthetic_bron(arguments.data_folder, scale)
+        key = f'scale_{scale:g}'
+        if not arguments.no_equivalence:
+            all_differences += [f'{key}: {difference}' for difference in check_equivalence(foldername) + check_parallel_equivalence(foldername)]
+        all_results[key] = run_benchmarks(foldername, arguments.repeat, not arguments.no_memory)
+        rows, regressions = compare_to_baseline(all_results[key], baseline.get(key, {}), arguments.tolerance)
+        all_regressions += [f'{key}: {name}' for name in regressions]
+        print(f'Scale {scale:g} ({foldername})')
+        print(tabulate(rows, headers=['step', 'seconds', 'items/s', 'peak MB', 'time vs baseline', 'memory vs baseline', ''], floatfmt='.3f'))
+        print()
+
+    if all_differences:
+        #Timings of wrong results are no baseline, so nothing is stored
+        print('Results that differ from the reference implementations:')
+        for difference in all_differences:
+            print(f'   - {difference}')
+        return 1
+    if arguments.save_baseline:
+        baseline.update(all_results)
+        Path(arguments.baseline).write_text(json.dumps(baseline, indent=2))
+        print(f'Baseline stored in {arguments.baseline}')
+    elif all_regressions:
+        print('Regressions compared to the baseline:')
+        for regression in all_regressions:
+            print(f'   - {regression}')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
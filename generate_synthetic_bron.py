@@ -0,0 +1,282 @@
+"""Generator for a synthetic BRON export.
+
+The real BRON download is too large to use in tests and benchmarks, so this script writes a fake export
+with the same folder layout, file names and fields as the real one:
+    - Accident data (Ongevallengegevens): ongevallen.txt, partijen.txt
+    - Network data (Netwerkgegevens): wegvakken.txt, hectopunten.txt, hectointervallen.txt, juncties.txt,
+      junctiehectometrering.txt, puntlocaties.txt
+    - Reference files Accidents / Reference files Network: code tables and a Definitie.txt file
+The values are random, but consistent with each other: accidents on the highway refer to existing highway
+road segments and hectometres, parties refer to existing accidents and road segments connect existing junctions.
+
+The size is set with a scale factor, where scale 1 gives base_n_accidents accidents.
+The road network does not grow with the scale, just like a multi-year export of the real network.
+
+Usage: python generate_synthetic_bron.py foldername --scale 10"""
+import argparse
+import csv
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+import highway_inspection_planning as HIP
+
+base_n_accidents = 20000
+base_n_roadsegments = 5000
+#Share of the accidents that happend on the highway, i.e. with a HECTOMETER
+highway_accident_fraction = 0.15
+#Share of the road segments that are part of a highway, i.e. with a WEGNUMMER
+highway_roadsegment_fraction = 0.4
+#Accidents and parties are written in blocks of this many accidents to keep the memory bounded at large scales
+block_size = 100000
+
+highways = ['A1', 'A2', 'A4', 'A7', 'A9', 'A12', 'A13', 'A15', 'A16', 'A20', 'A27', 'A28', 'A50', 'A58', 'A67', 'A73']
+reference_files_accidents = {
+    'objecttypes': ('OTE_ID', 'OTE_OMS', ['Personenauto', 'Bestelauto', 'Vrachtauto', 'Trekker', 'Trekker met oplegger', 'Landbouwvoertuig',
+                                          'Bus', 'Motor', 'Bromfiets', 'Fiets', 'Voetganger', 'Boom', 'Lichtmast', 'Overig vast object',
+                                          'Overig wegmeubilair', 'Los voorwerp', 'Dier', 'Onbekend']),
+    'bewegingen': ('BWG_ID', 'BWG_OMS', ['Rechtdoor', 'Afslaan links', 'Afslaan rechts', 'Inhalen', 'Van rijstrook wisselen', 'Slippen',
+                                         'Kantelen', 'Over de kop', 'Uitrollen', 'Tot stilstand komen', 'Achteruit', 'Keren']),
+    'wegverhardingen': ('WVG_ID', 'WVG_OMS', ['Asfalt/Beton', 'Klinkers', 'Onverhard', 'Zeer open asfalt beton']),
+    'wegverlichtingen': ('WVL_ID', 'WVL_OMS', ['Brandend', 'Niet brandend', 'Niet aanwezig', 'Onbekend']),
+    'wegdekken': ('WDK_ID', 'WDK_OMS', ['Droog', 'Nat/Vochtig', 'Sneeuw/IJzel', 'Onbekend']),
+    'lichtgesteldheden': ('LGD_ID', 'LGD_OMS', ['Daglicht', 'Duisternis', 'Schemer', 'Onbekend']),
+    'aardongevallen': ('AOL_ID', 'AOL_OMS', ['Flank', 'Kop/staart', 'Frontaal', 'Eenzijdig', 'Vast voorwerp', 'Dier', 'Onbekend']),
+    'dagdelen': ('DDL_ID', 'DDL_OMS', ['Nacht', 'Ochtend', 'Middag', 'Avond'])}
+reference_files_network = {
+    'baansubsoorten': ('BST_CODE', 'BST_OMS', {'HR': 'Hoofdrijbaan', 'PST': 'Parallelstrook', 'AFR': 'Afrit', 'OPR': 'Oprit', 'VBW': 'Verbindingsweg'}),
+    'relatieveposities': ('RPE_CODE', 'RPE_OMS', {'L': 'Links', 'R': 'Rechts', 'M': 'Midden', '#': 'Onbekend'})}
+
+def generate_bron(foldername, scale=1, n_accidents=None, n_roadsegments=base_n_roadsegments, years=(2010, 2019), seed=0):
+    """Writes a synthetic BRON export to foldername.
+       The number of accidents is scale * base_n_accidents, unless n_accidents is given.
+       Returns a dictionary with the number of rows written per file"""
+    rng = np.random.default_rng(seed)
+    if n_accidents is None:
+        n_accidents = int(round(scale * base_n_accidents))
+    folder = Path(foldername)
+    for subfolder in [HIP.accident_data_foldername, HIP.network_data_foldername, HIP.ref_files_accidents_foldername, HIP.ref_files_network_foldername]:
+        Path(folder, subfolder).mkdir(parents=True, exist_ok=True)
+
+    network = generate_network(rng, n_roadsegments)
+    rows_written = {}
+    for name, frame in network.items():
+        write_bron_file(frame, Path(folder, HIP.network_data_foldername, name+'.txt'))
+        rows_written[name] = len(frame)
+
+    rows_written['ongevallen'] = rows_written['partijen'] = 0
+    first_PTJ_ID = 1
+    for first_accident in range(0, n_accidents, block_size):
+        n_block = min(block_size, n_accidents - first_accident)
+        accidents = generate_accidents(rng, network, first_accident, n_block, years)
+        parties = generate_parties(rng, accidents, first_PTJ_ID)
+        first_PTJ_ID += len(parties)
+        append = first_accident > 0
+        write_bron_file(accidents, Path(folder, HIP.accident_data_foldername, 'ongevallen.txt'), append)
+        write_bron_file(parties, Path(folder, HIP.accident_data_foldername, 'partijen.txt'), append)
+        rows_written['ongevallen'] += len(accidents)
+        rows_written['partijen'] += len(parties)
+
+    for name, (code, description, values) in reference_files_accidents.items():
+        write_bron_file(pd.DataFrame({code: range(1, len(values)+1), description: values}), Path(folder, HIP.ref_files_accidents_foldername, name+'.txt'))
+    for name, (code, description, values) in reference_files_network.items():
+        write_bron_file(pd.DataFrame({code: list(values.keys()), description: list(values.values())}), Path(folder, HIP.ref_files_network_foldername, name+'.txt'))
+
+    definition = (f'Synthetisch BRON bestand, gegenereerd met generate_synthetic_bron.py (seed {seed})\n'
+                  f'Periode: {years[0]}0101 - {years[1]}1231\n'
+                  f'Aantal ongevallen: {rows_written["ongevallen"]}\n'
+                  f'Aantal wegvakken: {rows_written["wegvakken"]}\n')
+    for subfolder in [HIP.accident_data_foldername, HIP.network_data_foldername, HIP.ref_files_accidents_foldername, HIP.ref_files_network_foldername]:
+        Path(folder, subfolder, 'Definitie.txt').write_text(definition, encoding='utf-8')
+    return rows_written
+
+def write_bron_file(frame, filename, append=False):
+    """Helper function to write one of the BRON files, text values are quoted like in the real export"""
+    frame.to_csv(filename, index=False, mode='a' if append else 'w', header=not append, quoting=csv.QUOTE_NONNUMERIC)
+
+def generate_network(rng, n_roadsegments):
+    """Generates the network files. Highway road segments are laid out in order along straight roads,
+       with one carriageway per driving direction, so consecutive segments share a junction and have increasing hectometres.
+       The remaining road segments have no WEGNUMMER and connect random junctions"""
+    n_highway = int(n_roadsegments * highway_roadsegment_fraction)
+    n_other = n_roadsegments - n_highway
+    WVK_IDs = 250000000 + np.arange(n_roadsegments) * 3
+    highway_WVK_IDs = WVK_IDs[:n_highway]
+
+    #Highway segments: split over the roads and driving directions, every carriageway is a chain of junctions
+    carriageway = np.arange(n_highway) % (2 * len(highways))
+    road = carriageway // 2
+    direction = np.where(carriageway % 2 == 0, 'H', 'T')
+    order = np.argsort(carriageway, kind='stable')
+    position = np.empty(n_highway, dtype=int)
+    position[order] = np.arange(n_highway) - np.searchsorted(carriageway[order], carriageway[order])
+    length_hm = rng.integers(2, 15, n_highway)
+    begin_hm = np.zeros(n_highway, dtype=int)
+    for c in np.unique(carriageway):
+        segments = order[carriageway[order] == c]
+        begin_hm[segments] = np.concatenate([[0], np.cumsum(length_hm[segments])[:-1]])
+    #Both directions of a road share the junctions, junction k of a road lies at the start of segment k
+    n_positions = np.bincount(carriageway, minlength=2 * len(highways)).reshape(-1, 2).max(axis=1) + 1
+    road_first_junction = np.concatenate([[0], np.cumsum(n_positions)[:-1]])
+    begin_junction = road_first_junction[road] + position
+    end_junction = begin_junction + 1
+    begin_junction, end_junction = np.where(direction == 'H', begin_junction, end_junction), np.where(direction == 'H', end_junction, begin_junction)
+    n_highway_junctions = int(n_positions.sum())
+    n_junctions = n_highway_junctions + max(n_other // 2, 1)
+    JTE_IDs = 600000000 + np.arange(n_junctions) * 7
+    other_begin = rng.integers(0, n_junctions, n_other)
+    other_end = (other_begin + 1 + rng.integers(0, 50, n_other)) % n_junctions
+
+    roadnumbers = np.array(highways, dtype=object)[road]
+    wegvakken = pd.DataFrame({
+        'WVK_ID': WVK_IDs,
+        'WVK_BEGDAT': rng.choice([19970101, 20040101, 20120101], n_roadsegments),
+        'WVK_ENDDAT': np.where(rng.random(n_roadsegments) < 0.05, 20180101.0, np.nan),
+        'JTE_ID_BEG': JTE_IDs[np.concatenate([begin_junction, other_begin])],
+        'JTE_ID_END': JTE_IDs[np.concatenate([end_junction, other_end])],
+        'WEGBEHSRT': np.concatenate([np.full(n_highway, 'R', dtype=object), rng.choice(['G', 'P', 'W'], n_other)]),
+        'WEGNUMMER': np.concatenate([roadnumbers, np.full(n_other, None, dtype=object)]),
+        'WEGDEELLTR': np.concatenate([np.full(n_highway, '#', dtype=object), np.full(n_other, None, dtype=object)]),
+        'HECTOLTTR': np.concatenate([np.full(n_highway, '#', dtype=object), np.full(n_other, None, dtype=object)]),
+        'BST_CODE': np.concatenate([rng.choice(['HR', 'HR', 'HR', 'AFR', 'OPR'], n_highway), np.full(n_other, None, dtype=object)]),
+        'RPE_CODE': np.concatenate([np.where(direction == 'H', 'R', 'L'), np.full(n_other, '#', dtype=object)]),
+        'RIJRICHTNG': np.concatenate([direction, rng.choice(['H', 'T', None], n_other)]),
+        'STT_NAAM': np.concatenate([np.full(n_highway, None, dtype=object), [f'Straat {i}' for i in range(n_other)]]),
+        'GME_ID': rng.integers(1, 400, n_roadsegments),
+        'GME_NAAM': [f'Gemeente {i}' for i in rng.integers(1, 400, n_roadsegments)],
+        'FK_VELD5': [f'WVK{ID}' for ID in WVK_IDs],
+        'WEGNR_HMP': np.concatenate([roadnumbers, np.full(n_other, None, dtype=object)])})
+
+    hectopunten_segment = np.repeat(np.arange(n_highway), length_hm)
+    hectopunten_offset = np.arange(len(hectopunten_segment)) - np.repeat(np.cumsum(length_hm) - length_hm, length_hm)
+    hectopunten_HM = begin_hm[hectopunten_segment] + hectopunten_offset
+    hectopunten = pd.DataFrame({
+        'WVK_ID': highway_WVK_IDs[hectopunten_segment],
+        'WVK_BEGDAT': wegvakken['WVK_BEGDAT'].to_numpy()[hectopunten_segment],
+        'HECTOMETER': hectopunten_HM,
+        'AFSTAND': hectopunten_offset * 100,
+        'FK_VELD5': [f'HTT{WVK_ID}{HM}' for WVK_ID, HM in zip(highway_WVK_IDs[hectopunten_segment], hectopunten_HM)]})
+    hectointervallen = pd.DataFrame({
+        'WVK_ID': highway_WVK_IDs,
+        'WVK_BEGDAT': wegvakken['WVK_BEGDAT'].to_numpy()[:n_highway],
+        'BEGAFSTAND': 0,
+        'ENDAFSTAND': length_hm * 100,
+        'BEGKM': begin_hm / 10,
+        'ENDKM': (begin_hm + length_hm) / 10})
+    juncties = pd.DataFrame({
+        'JTE_ID': JTE_IDs,
+        'WBRSRT_R': rng.choice(['R', 'G', 'P'], n_junctions),
+        'ANTL_TAK': rng.integers(2, 5, n_junctions),
+        'FK_VELD5': [f'JTE{ID}' for ID in JTE_IDs]})
+    junction_road = np.repeat(np.arange(len(highways)), n_positions)
+    junction_km = np.zeros(n_highway_junctions)
+    junction_km[begin_junction[direction == 'H']] = begin_hm[direction == 'H'] / 10
+    junctiehectometrering = pd.DataFrame({
+        'JTE_ID': JTE_IDs[:n_highway_junctions],
+        'WEGNUMMER': np.array(highways, dtype=object)[junction_road],
+        'KILOMETER': junction_km})
+
+    #Every road is a straight line through the Netherlands (RD coordinates), other junctions are placed at random
+    road_origin = np.column_stack([rng.uniform(20000, 260000, len(highways)), rng.uniform(320000, 600000, len(highways))])
+    road_angle = rng.uniform(0, 2 * np.pi, len(highways))
+    junction_xy = np.column_stack([rng.uniform(10000, 270000, n_junctions), rng.uniform(310000, 610000, n_junctions)])
+    junction_km_on_road = np.arange(n_highway_junctions) - road_first_junction[junction_road]
+    junction_xy[:n_highway_junctions, 0] = road_origin[junction_road, 0] + np.cos(road_angle[junction_road]) * junction_km_on_road * 1000
+    junction_xy[:n_highway_junctions, 1] = road_origin[junction_road, 1] + np.sin(road_angle[junction_road]) * junction_km_on_road * 1000
+    segment_begin_xy = junction_xy[np.concatenate([begin_junction, other_begin])]
+    segment_end_xy = junction_xy[np.concatenate([end_junction, other_end])]
+    segment_xy = (segment_begin_xy + segment_end_xy) / 2
+    fraction = (hectopunten_offset + 0.5) / length_hm[hectopunten_segment]
+    hectopunten_xy = segment_begin_xy[hectopunten_segment] + (segment_end_xy[hectopunten_segment] - segment_begin_xy[hectopunten_segment]) * fraction[:, None]
+    puntlocaties = pd.DataFrame({
+        'FK_VELD5': np.concatenate([juncties['FK_VELD5'], wegvakken['FK_VELD5'], hectopunten['FK_VELD5']]),
+        'X_COORD': np.round(np.concatenate([junction_xy[:, 0], segment_xy[:, 0], hectopunten_xy[:, 0]]), 1),
+        'Y_COORD': np.round(np.concatenate([junction_xy[:, 1], segment_xy[:, 1], hectopunten_xy[:, 1]]), 1)})
+
+    return {'wegvakken': wegvakken, 'hectopunten': hectopunten, 'hectointervallen': hectointervallen, 'juncties': juncties,
+            'junctiehectometrering': junctiehectometrering, 'puntlocaties': puntlocaties}
+
+def generate_accidents(rng, network, first_accident, n_accidents, years):
+    """Generates a block of accidents. Highway accidents get a road segment and a hectometre on that segment,
+       the other accidents happend on a non-highway road segment or on a junction"""
+    wegvakken = network['wegvakken']
+    hectopunten = network['hectopunten']
+    highway = wegvakken['WEGNUMMER'].notna().to_numpy()
+    year = rng.integers(years[0], years[1] + 1, n_accidents)
+    month = rng.integers(1, 13, n_accidents)
+    day = rng.integers(1, 29, n_accidents)
+    VKL_NUMMER = year.astype(np.int64) * 10**7 + (first_accident + np.arange(n_accidents)) * 3 + 1
+
+    on_highway = rng.random(n_accidents) < highway_accident_fraction
+    on_junction = ~on_highway & (rng.random(n_accidents) < 0.3)
+    hectopunt = rng.integers(0, len(hectopunten), n_accidents)
+    other_segments = wegvakken['WVK_ID'].to_numpy()[~highway]
+    WVK_ID = np.where(on_highway, hectopunten['WVK_ID'].to_numpy()[hectopunt], rng.choice(other_segments, n_accidents)).astype(float)
+    WVK_ID[on_junction] = np.nan
+    HECTOMETER = np.where(on_highway, hectopunten['HECTOMETER'].to_numpy()[hectopunt], np.nan)
+    JTE_ID = np.where(on_junction, rng.choice(network['juncties']['JTE_ID'].to_numpy(), n_accidents), np.nan)
+    FK_VELD5 = np.where(on_highway, hectopunten['FK_VELD5'].to_numpy()[hectopunt],
+                        np.where(on_junction, [f'JTE{ID:.0f}' for ID in JTE_ID], [f'WVK{ID:.0f}' for ID in WVK_ID]))
+
+    accidents = pd.DataFrame({'VKL_NUMMER': VKL_NUMMER, 'JAAR_VKL': year})
+    accidents['REGNUMMER'] = [f'{number}' for number in rng.integers(10**9, 3 * 10**9, n_accidents)]
+    accidents['PVOPGEM'] = rng.choice(['J', None], n_accidents, p=[0.9, 0.1])
+    #Only a part of the accidents is registered with the exact date
+    accidents['DATUM_VKL'] = np.where(rng.random(n_accidents) < 0.6, year * 10000 + month * 100 + day, np.nan)
+    accidents['MND_NUMMER'] = np.where(rng.random(n_accidents) < 0.8, month, np.nan)
+    accidents['AP3_CODE'] = rng.choice(['UMS', 'LET', 'DOD'], n_accidents, p=[0.8, 0.18, 0.02])
+    accidents['MAXSNELHD'] = np.where(on_highway, rng.choice([100.0, 120.0, 130.0], n_accidents), rng.choice([30.0, 50.0, 80.0, np.nan], n_accidents))
+    accidents['JTE_ID'] = JTE_ID
+    accidents['WVK_ID'] = WVK_ID
+    accidents['HECTOMETER'] = HECTOMETER
+    accidents['FK_VELD5'] = FK_VELD5
+    accidents['PVE_NAAM'] = rng.choice(['Groningen', 'Friesland', 'Drenthe', 'Overijssel', 'Flevoland', 'Gelderland', 'Utrecht',
+                                        'Noord-Holland', 'Zuid-Holland', 'Zeeland', 'Noord-Brabant', 'Limburg'], n_accidents)
+    for field, (code, description, values) in [('WVL_ID', reference_files_accidents['wegverlichtingen']), ('WVG_ID', reference_files_accidents['wegverhardingen']),
+                                               ('WDK_ID', reference_files_accidents['wegdekken']), ('LGD_ID', reference_files_accidents['lichtgesteldheden']),
+                                               ('AOL_ID', reference_files_accidents['aardongevallen']), ('DDL_ID', reference_files_accidents['dagdelen'])]:
+        accidents[field] = optional_codes(rng, len(values), n_accidents, 0.85)
+    fill_remaining_fields(rng, accidents, 'ongevallen')
+    return accidents
+
+def generate_parties(rng, accidents, first_PTJ_ID):
+    """Generates the parties of a block of accidents, most accidents have one to three parties and some have none"""
+    n_parties = rng.choice([0, 1, 1, 2, 2, 2, 3, 3, 4, 5, 6], len(accidents))
+    n = int(n_parties.sum())
+    parties = pd.DataFrame({'PTJ_ID': first_PTJ_ID + np.arange(n),
+                            'VKL_NUMMER': np.repeat(accidents['VKL_NUMMER'].to_numpy(), n_parties),
+                            'NUMMER': np.arange(n) - np.repeat(np.cumsum(n_parties) - n_parties, n_parties) + 1})
+    parties['OTE_ID'] = optional_codes(rng, len(reference_files_accidents['objecttypes'][2]), n, 0.95)
+    parties['BWG_ID_1'] = optional_codes(rng, len(reference_files_accidents['bewegingen'][2]), n, 0.7)
+    parties['BWG_ID_2'] = optional_codes(rng, len(reference_files_accidents['bewegingen'][2]), n, 0.2)
+    parties['VOORGBEW'] = optional_codes(rng, len(HIP.create_intended_movements_ref_file()), n, 0.7)
+    parties['SCHADE'] = rng.choice(['J', 'N', None], n, p=[0.6, 0.3, 0.1])
+    parties['GESLACHT'] = rng.choice(['M', 'V', None], n)
+    parties['LEEFTIJD'] = np.where(rng.random(n) < 0.8, rng.integers(16, 90, n), np.nan)
+    fill_remaining_fields(rng, parties, 'partijen')
+    return parties
+
+def optional_codes(rng, n_codes, n, fraction_filled):
+    """Helper function that draws codes 1..n_codes, of which only fraction_filled is filled in and the rest is empty"""
+    return np.where(rng.random(n) < fraction_filled, rng.integers(1, n_codes + 1, n), np.nan)
+
+def fill_remaining_fields(rng, frame, bron_filename):
+    """Helper function that adds the remaining declared BRON fields with sparse random values,
+       so the generated files have the same columns (and roughly the same width) as the real export"""
+    n = len(frame)
+    for field in HIP.bron_text_fields[bron_filename]:
+        if field not in frame:
+            frame[field] = rng.choice(['A', 'B', 'C', None, None, None], n)
+    for field in HIP.bron_numeric_fields[bron_filename]:
+        if field not in frame:
+            frame[field] = np.where(rng.random(n) < 0.3, rng.integers(1, 10, n), np.nan)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic BRON export')
+    parser.add_argument('foldername', help='folder to write the export to')
+    parser.add_argument('--scale', type=float, default=1, help=f'number of accidents as a multiple of {base_n_accidents}')
+    parser.add_argument('--roadsegments', type=int, default=base_n_roadsegments, help='number of road segments')
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+    for name, n_rows in generate_bron(arguments.foldername, arguments.scale, n_roadsegments=arguments.roadsegments, seed=arguments.seed).items():
+        print(f'{name}: {n_rows} rows')
@@ -1,43 +1,81 @@
 import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
 from pathlib import Path
-from tabulate import tabulate
-import random
 import warnings
 import os
 import copy
 import pickle
+import json
+import heapq
+import hashlib
+import time
+import functools
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
 
-warnings.filterwarnings("ignore")
-pd.set_option('display.max_columns', None)
-pd.set_option('display.max_rows', 4)
+#Matplotlib (plotting) and tabulate (printing) are imported in the functions that use them, 
+#so scripts that only import and assess the data do not pay for importing them
 
-def import_data(foldername):
+#Pandas display options for the interactive use of HIP, e.g. in the DEMO notebook. They are applied by configure_display
+display_options = {'display.max_columns': None, 'display.max_rows': 4}
+
+def configure_display(silence_warnings=True):
+    """Applies the display_options to pandas and, if silence_warnings is True, ignores all warnings.
+       These settings change the whole Python session, so they are not applied on import but only when this function is called"""
+    if silence_warnings:
+        warnings.filterwarnings("ignore")
+    for option, value in display_options.items():
+        pd.set_option(option, value)
+
+accident_data_foldername = r"Accident data (Ongevallengegevens)"
+network_data_foldername = r"Network data (Netwerkgegevens)"
+ref_files_accidents_foldername = r"Reference files Accidents"
+ref_files_network_foldername = r"Reference files Network"
+
+def import_data(foldername, chunksize=None, usecols=None):
     """Function to import all data from the BRON database and convert it from CSV format to Pandas DataFrames.
        To make sure only accidents on highways are included, the filter for HECTOMETER is not empty is performed on accidents.
        Additionaly the filter WEGNUMMER is not empty is performed to filter roadsegments that are part of highways.
        
-       The reference files are stored as small conversion Pandas Dataframes and bundled into the ref_files dictionary"""
-    txt = ".txt"
-    accident_data_foldername = r"Accident data (Ongevallengegevens)"
-    network_data_foldername = r"Network data (Netwerkgegevens)"
-    ref_files_accidents_foldername = r"Reference files Accidents"
-    ref_files_network_foldername = r"Reference files Network"
+       The reference files are stored as small conversion Pandas Dataframes and bundled into the ref_files dictionary.
+       The other network files (hectopunten, juncties, puntlocaties, ...) are kept in data.network, they are used by the spatial index.
+
+       For large (multi-year) exports a chunksize can be given. The files are then streamed with declared dtypes,
+       see import_data_streaming, which keeps the peak memory close to the size of the filtered result.
+       The columns can only be limited with usecols while streaming, so if usecols is given without a chunksize
+       the files are streamed with the default chunksize of import_data_streaming."""
+    if chunksize:
+        return import_data_streaming(foldername, chunksize, usecols)
+    if usecols is not None:
+        return import_data_streaming(foldername, usecols=usecols)
 
     accidents_source = pd.read_csv(open(Path(foldername, accident_data_foldername, 'ongevallen.txt'), 'r'), encoding='utf-8').set_index('VKL_NUMMER')
     #Filter only those accidents that happend on the highway
     accidents_source = accidents_source[accidents_source['HECTOMETER'].notna()]
     parties_source = pd.read_csv(Path(foldername, accident_data_foldername, 'partijen.txt')).set_index('PTJ_ID')
 
-    hectointervallen =  pd.read_csv(open(Path(foldername, network_data_foldername, 'hectointervallen.txt'), 'r'), encoding='utf-8')
-    hectopunten =  pd.read_csv(open(Path(foldername, network_data_foldername, 'hectopunten.txt'), 'r'), encoding='utf-8')
-    junctiehectometrering =  pd.read_csv(open(Path(foldername, network_data_foldername, 'junctiehectometrering.txt'), 'r'), encoding='utf-8')
-    juncties =  pd.read_csv(open(Path(foldername, network_data_foldername, 'juncties.txt'), 'r'), encoding='utf-8')
-    puntlocaties =  pd.read_csv(open(Path(foldername, network_data_foldername, 'puntlocaties.txt'), 'r'), encoding='utf-8')
+    network = import_network(foldername)
     wegvakken =  pd.read_csv(open(Path(foldername, network_data_foldername, 'wegvakken.txt'), 'r'), encoding='utf-8')
     #Filter only those roadsegments which are on the highway
     wegvakken = wegvakken[wegvakken['WEGNUMMER'].notna()]
 
+    ref_files = import_ref_files(foldername)
+    
+    return HIPData(accidents_source, parties_source, wegvakken, ref_files, network)
+
+network_files = ['hectointervallen', 'hectopunten', 'junctiehectometrering', 'juncties', 'puntlocaties']
+
+def import_network(foldername):
+    """Helper function to import the network files other than wegvakken into the network dictionary"""
+    network = {}
+    for network_file in network_files:
+        network[network_file] = pd.read_csv(open(Path(foldername, network_data_foldername, network_file+'.txt'), 'r'), encoding='utf-8')
+    return network
+
+def import_ref_files(foldername):
+    """Helper function to import the reference files of the accidents and network data into the ref_files dictionary"""
+    txt = ".txt"
     ref_file_accidents_names = os.listdir(Path(foldername, ref_files_accidents_foldername))
     ref_file_network_names = os.listdir(Path(foldername, ref_files_network_foldername))
 
@@ -54,8 +92,93 @@ def import_data(foldername):
         ref_files[ref_file_name] = pd.read_csv(open(Path(foldername, ref_files_network_foldername, ref_file_name+txt), 'r'), index_col=0)
     
     ref_files['intended_movements'] = create_intended_movements_ref_file()
-    
-    return accidents_source, parties_source, wegvakken, ref_files
+    return ref_files
+
+#Declared fields for the streaming import, following the formats (Num/Tekst) in the BRON manual.
+#Numeric fields are read as float64, because most of them are optional and empty values become NaN.
+#Only the mandatory identifiers are read as integers. Columns that are not listed are inferred by Pandas.
+bron_text_fields = {
+    'ongevallen': ['REGNUMMER', 'PVOPGEM', 'DAG_CODE', 'TIJDSTIP', 'UUR', 'AP3_CODE', 'AP4_CODE', 'AP5_CODE', 'MNE_CODE', 'NIVEAUKOP', 'WSE_AN', 'BEBKOM',
+                   'WVG_AN', 'WDK_AN', 'WGD_CODE_1', 'WGD_CODE_2', 'BZD_VM_AN', 'BZD_IF_AN', 'BZD_TA_AN', 'FK_VELD5', 'HUISNUMMER', 'GME_NAAM', 'PVE_CODE',
+                   'PVE_NAAM', 'KDD_NAAM', 'PLT_NAAM', 'DIENSTCODE', 'DIENSTNAAM', 'DISTRCODE', 'DISTRNAAM', 'DAGTYPE', 'IND_ALC'],
+    'partijen': ['DOORRIJDER', 'OTE_AN', 'NTT_CODE_V', 'VTGVERZ', 'SCHADE', 'GETRAANH', 'GEVSTOF', 'VTGVERL', 'NTT_CODE_B', 'GESLACHT', 'BLAASTEST', 'ART8',
+                 'MEDICGEBR', 'RIJBEWGEL', 'RIJBEWCAT', 'RIJBEWBEG', 'BROMFCERT', 'UITGPOS_AN', 'AGT_TYPE', 'BWG_AN', 'TDT_AN'],
+    'wegvakken': ['WEGBEHSRT', 'WEGNUMMER', 'WEGDEELLTR', 'HECTOLTTR', 'BST_CODE', 'RPE_CODE', 'RIJRICHTNG', 'STT_TYPE', 'STT_NAAM', 'WPS_NAMNEN', 'GME_NAAM',
+                  'HNRSTRLNKS', 'HNRSTRRHTS', 'SLE_TYPE', 'FK_VELD1', 'FK_VELD5', 'ROUTELTR', 'ROUTELTR2', 'ROUTELTR3', 'ROUTELTR4', 'WEGNR_HMP']}
+bron_numeric_fields = {
+    'ongevallen': ['DATUM_VKL', 'MND_NUMMER', 'DDL_ID', 'ANTL_SLA', 'ANTL_DOD', 'ANTL_GZH', 'ANTL_SEH', 'ANTL_GOV', 'ANTL_PTJ', 'ANTL_TDT', 'AOL_ID',
+                   'WSE_ID', 'MAXSNELHD', 'WVL_ID', 'WVG_ID', 'WDK_ID', 'LGD_ID', 'ZAD_ID', 'BZD_ID_VM1', 'BZD_ID_VM2', 'BZD_ID_VM3', 'BZD_ID_IF1', 'BZD_ID_IF2',
+                   'BZD_ID_IF3', 'BZD_ID_TA1', 'BZD_ID_TA2', 'BZD_ID_TA3', 'JTE_ID', 'WVK_ID', 'HECTOMETER', 'GME_ID', 'WEEKNR'],
+    'partijen': ['OTE_ID', 'ANTL_PAS', 'GEBDAT', 'GEBJAAR', 'LEEFTIJD', 'LKE_ID', 'UITGPOS1', 'UITGPOS2', 'VOORGBEW', 'AGT_ID_1', 'AGT_ID_2',
+                 'BWG_ID_1', 'BWG_ID_2', 'TDT_ID_1', 'TDT_ID_2', 'TDT_ID_3'],
+    'wegvakken': ['WVK_ENDDAT', 'GME_ID', 'E_HNR_LNKS', 'E_HNR_RHTS', 'L_HNR_LNKS', 'L_HNR_RHTS', 'KLOK_BEG',
+                  'KLOK_END', 'SLE_NUMMER']}
+bron_integer_fields = {
+    'ongevallen': ['VKL_NUMMER', 'JAAR_VKL'],
+    'partijen': ['PTJ_ID', 'VKL_NUMMER', 'NUMMER'],
+    'wegvakken': ['WVK_ID', 'WVK_BEGDAT', 'JTE_ID_BEG', 'JTE_ID_END']}
+#Fields that HIP itself needs, these are always read even if they are not in usecols
+bron_required_fields = {
+    'ongevallen': ['VKL_NUMMER', 'REGNUMMER', 'WVG_ID', 'WVK_ID', 'HECTOMETER'],
+    'partijen': ['PTJ_ID', 'VKL_NUMMER', 'OTE_ID', 'BWG_ID_1', 'BWG_ID_2'],
+    'wegvakken': ['WVK_ID', 'WEGNUMMER']}
+bron_frame_names = {'ongevallen': 'accidents', 'partijen': 'parties', 'wegvakken': 'roadsegments'}
+
+def bron_dtypes(bron_filename):
+    """Helper function that returns the declared dtypes for one of the BRON files.
+       The coded text fields are read as categoricals, the other text fields as strings"""
+    dtypes = {}
+    for field in bron_text_fields[bron_filename]:
+        dtypes[field] = 'category' if field in categorical_fields[bron_frame_names[bron_filename]] else str
+    for field in bron_numeric_fields[bron_filename]:
+        dtypes[field] = 'float64'
+    for field in bron_integer_fields[bron_filename]:
+        dtypes[field] = 'int64'
+    return dtypes
+
+def import_data_streaming(foldername, chunksize=100000, usecols=None):
+    """Function to import the BRON data in chunks with bounded memory. 
+       Instead of reading the complete files first, every chunk is filtered while streaming:
+        - accidents: only those that happend on the highway (HECTOMETER is not empty)
+        - parties: only those involved in one of the remaining accidents
+        - roadsegments: only those which are on the highway (WEGNUMMER is not empty)
+       The files are read with the declared dtypes from bron_dtypes. Optionally usecols can limit the columns per file,
+       e.g. usecols={'ongevallen': ['JAAR_VKL'], 'partijen': ['VOORGBEW']}. The fields in bron_required_fields are always read.
+       The other network files do not grow with the number of years and are read completely into data.network."""
+    usecols = usecols or {}
+    accidents_source = read_csv_filtered(Path(foldername, accident_data_foldername, 'ongevallen.txt'), 'ongevallen', chunksize, usecols.get('ongevallen'),
+                                         lambda chunk: chunk[chunk['HECTOMETER'].notna()]).set_index('VKL_NUMMER')
+    highway_accident_IDs = accidents_source.index.unique()
+    parties_source = read_csv_filtered(Path(foldername, accident_data_foldername, 'partijen.txt'), 'partijen', chunksize, usecols.get('partijen'),
+                                       lambda chunk: chunk[chunk['VKL_NUMMER'].isin(highway_accident_IDs)]).set_index('PTJ_ID')
+    wegvakken = read_csv_filtered(Path(foldername, network_data_foldername, 'wegvakken.txt'), 'wegvakken', chunksize, usecols.get('wegvakken'),
+                                  lambda chunk: chunk[chunk['WEGNUMMER'].notna()])
+    ref_files = import_ref_files(foldername)
+    return HIPData(accidents_source, parties_source, wegvakken, ref_files, import_network(foldername))
+
+def read_csv_filtered(filename, bron_filename, chunksize, usecols, row_filter):
+    """Helper function that reads a BRON file in chunks and only keeps the rows selected by row_filter"""
+    dtypes = bron_dtypes(bron_filename)
+    if usecols is not None:
+        usecols = list(dict.fromkeys(bron_required_fields[bron_filename] + list(usecols)))
+    chunks = []
+    with open(filename, 'r') as f:
+        for chunk in pd.read_csv(f, chunksize=chunksize, usecols=usecols, dtype=dtypes):
+            chunks.append(row_filter(chunk))
+    if not chunks:
+        with open(filename, 'r') as f:
+            return pd.read_csv(f, nrows=0, usecols=usecols, dtype=dtypes)
+    return concat_chunks(chunks)
+
+def concat_chunks(chunks):
+    """Helper function to concatenate chunks while keeping categorical columns categorical.
+       Every chunk has its own categories, so these are first unified over all chunks"""
+    dtypes = {}
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype):
+            categories = pd.api.types.union_categoricals([chunk[column] for chunk in chunks]).categories
+            dtypes[column] = pd.CategoricalDtype(categories)
+    return pd.concat([chunk.astype(dtypes) for chunk in chunks])
 
 def create_intended_movements_ref_file():
     """The intended movements are not included in the refernece files.
@@ -87,7 +210,109 @@ def open_data(filename):
        This function opens the data from a pickle file"""
     with open(filename, 'rb') as f:
         data = pickle.load(f)
-    return data
+    return prepare_data(data)
+
+#The coded text fields of BRON (see the manual) are stored as categoricals in the columnar cache
+categorical_fields = {
+    'accidents': ['PVOPGEM', 'DAG_CODE', 'AP3_CODE', 'AP4_CODE', 'AP5_CODE', 'MNE_CODE', 'NIVEAUKOP', 'BEBKOM', 'WGD_CODE_1', 'WGD_CODE_2',
+                  'GME_NAAM', 'PVE_CODE', 'PVE_NAAM', 'KDD_NAAM', 'PLT_NAAM', 'DIENSTCODE', 'DIENSTNAAM', 'DISTRCODE', 'DISTRNAAM', 'DAGTYPE', 'IND_ALC'],
+    'parties': ['DOORRIJDER', 'NTT_CODE_V', 'VTGVERZ', 'SCHADE', 'GETRAANH', 'GEVSTOF', 'VTGVERL', 'NTT_CODE_B', 'GESLACHT', 'BLAASTEST', 'ART8',
+                'MEDICGEBR', 'RIJBEWGEL', 'RIJBEWCAT', 'RIJBEWBEG', 'BROMFCERT', 'AGT_TYPE'],
+    'roadsegments': ['WEGBEHSRT', 'WEGNUMMER', 'WEGDEELLTR', 'HECTOLTTR', 'BST_CODE', 'RPE_CODE', 'RIJRICHTNG', 'STT_TYPE', 'WPS_NAMNEN', 'GME_NAAM',
+                     'HNRSTRLNKS', 'HNRSTRRHTS', 'SLE_TYPE', 'ROUTELTR', 'ROUTELTR2', 'ROUTELTR3', 'ROUTELTR4', 'WEGNR_HMP']}
+
+cache_frames = ['accidents', 'parties', 'roadsegments']
+cache_manifest_filename = 'manifest.json'
+
+def source_signature(foldername):
+    """Helper function that describes the current state of the BRON source files by their size and modification time.
+       The signature is stored with the cache, so the cache is invalidated automatically when a source file changes"""
+    signature = {}
+    for path in sorted(Path(foldername).rglob('*.txt')):
+        stat = path.stat()
+        signature[path.relative_to(foldername).as_posix()] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+def save_cache(cache_foldername, data, foldername=None):
+    """Saves the data to a columnar cache folder with one Parquet file per dataframe.
+       Compared to save_data, the dtypes are stored explicitly, the coded BRON fields are categorical encoded
+       and columns can later be loaded selectively with open_cache.
+       Columns that contain a mix of Python objects (e.g. REGNUMMER) cannot be stored in Parquet and are kept in a small pickle file.
+       If the BRON foldername is given, its source signature is stored so that import_data_cached can check whether the cache is still valid."""
+    cache_folder = Path(cache_foldername)
+    cache_folder.mkdir(parents=True, exist_ok=True)
+    manifest = {'frames': {}, 'source': source_signature(foldername) if foldername is not None else None}
+    for name, frame in zip(cache_frames, data):
+        frame = frame.copy()
+        object_columns = []
+        for column in frame.columns:
+            if frame[column].dtype != object:
+                continue
+            inferred = pd.api.types.infer_dtype(frame[column], skipna=True)
+            if inferred == 'string' and column in categorical_fields[name]:
+                frame[column] = frame[column].astype('category')
+            elif inferred not in ['string', 'empty']:
+                object_columns.append(column)
+        frame.drop(columns=object_columns).to_parquet(Path(cache_folder, name+'.parquet'), engine='pyarrow')
+        with open(Path(cache_folder, name+'_objects.p'), 'wb') as f:
+            pickle.dump(frame[object_columns], f)
+        manifest['frames'][name] = {'columns': list(frame.columns), 'dtypes': {column: str(dtype) for column, dtype in frame.dtypes.items()},
+                                    'object_columns': object_columns}
+    with open(Path(cache_folder, 'ref_files.p'), 'wb') as f:
+        pickle.dump(data[3], f)
+    network = getattr(data, 'network', None) or {}
+    for name, frame in network.items():
+        frame.to_parquet(Path(cache_folder, 'network_'+name+'.parquet'), engine='pyarrow')
+    manifest['network'] = list(network.keys())
+    #The manifest is written last, so an interrupted save never results in a cache that looks valid
+    with open(Path(cache_folder, cache_manifest_filename), 'w') as f:
+        json.dump(manifest, f)
+
+def open_cache(cache_foldername, columns=None):
+    """Opens the data from a columnar cache folder created by save_cache.
+       Optionally only a selection of columns is loaded, e.g. columns={'accidents': ['WVK_ID', 'JAAR_VKL'], 'parties': ['VKL_NUMMER', 'OTE_ID']}.
+       Dataframes that are not mentioned in columns are loaded completely. The Parquet files are memory-mapped while reading."""
+    cache_folder = Path(cache_foldername)
+    with open(Path(cache_folder, cache_manifest_filename), 'r') as f:
+        manifest = json.load(f)
+    columns = columns or {}
+    frames = []
+    for name in cache_frames:
+        frame_manifest = manifest['frames'][name]
+        selected_columns = columns.get(name, frame_manifest['columns'])
+        object_columns = [column for column in selected_columns if column in frame_manifest['object_columns']]
+        parquet_columns = [column for column in selected_columns if column not in object_columns]
+        frame = pd.read_parquet(Path(cache_folder, name+'.parquet'), engine='pyarrow', columns=parquet_columns, memory_map=True)
+        for column in parquet_columns:
+            #Parquet returns empty text values as None, while read_csv uses NaN
+            if frame[column].dtype == object:
+                frame[column] = frame[column].mask(frame[column].isna(), np.nan)
+        if object_columns:
+            with open(Path(cache_folder, name+'_objects.p'), 'rb') as f:
+                frame = frame.join(pickle.load(f)[object_columns])
+        frames.append(frame[selected_columns])
+    with open(Path(cache_folder, 'ref_files.p'), 'rb') as f:
+        ref_files = pickle.load(f)
+    network = None
+    if manifest.get('network'):
+        network = {name: pd.read_parquet(Path(cache_folder, 'network_'+name+'.parquet'), engine='pyarrow', memory_map=True) for name in manifest['network']}
+    return HIPData(*frames, ref_files, network)
+
+def cache_is_valid(cache_foldername, foldername):
+    """Checks whether the cache folder exists and was created from the current version of the BRON source files"""
+    manifest_filename = Path(cache_foldername, cache_manifest_filename)
+    if not manifest_filename.exists():
+        return False
+    with open(manifest_filename, 'r') as f:
+        manifest = json.load(f)
+    return manifest['source'] == source_signature(foldername)
+
+def import_data_cached(foldername, cache_foldername, columns=None):
+    """Imports the data from the columnar cache if it is still valid for the BRON source files in foldername.
+       Otherwise the data is imported with import_data and the cache is (re)written, so the next call is a warm start."""
+    if not cache_is_valid(cache_foldername, foldername):
+        save_cache(cache_foldername, import_data(foldername), foldername)
+    return open_cache(cache_foldername, columns)
 
 def load_fields_descriptions(descriptions_filename):
     """Using the provided Excel with field names the file can be imported and converted to Python format.
@@ -113,10 +338,14 @@ def load_fields_descriptions(descriptions_filename):
     
     return dict_descriptions_accidents, dict_descriptions_roadsegments, dict_descriptions_parties
 
-def barplot_parties(parties, ref_files, ylabel, groupby='OTE_ID', ref_file=False, description_var=False):
-    """For data visualisation purposes this function can create simple bar plots for any of the variables of parties"""
+def barplot_parties(parties, ref_files, ylabel, groupby='OTE_ID', ref_file=False, description_var=False, cube=None):
+    """For data visualisation purposes this function can create simple bar plots for any of the variables of parties.
+       If an AggregateCube is given and groupby is one of its dimensions, the counts are read from the cube"""
     import matplotlib.pyplot as plt
-    objecttypes_count = parties.groupby(groupby)['VKL_NUMMER'].count()
+    if cube is not None and groupby in party_dimensions:
+        objecttypes_count = cube.rollup([groupby], 'n_parties')
+    else:
+        objecttypes_count = parties.groupby(groupby)['VKL_NUMMER'].count()
     objecttypes_count = objecttypes_count.sort_values(ascending=True)
     if ref_file:
         plt.barh(ref_files[ref_file].loc[list(objecttypes_count.index)][description_var].iloc[-15:], objecttypes_count.iloc[-15:], color='gray')
@@ -125,10 +354,14 @@ def barplot_parties(parties, ref_files, ylabel, groupby='OTE_ID', ref_file=False
     plt.ylabel(ylabel, fontsize=16)
     plt.show()
 
-def barplot_accidents(accidents, ref_files, ylabel, groupby='JAAR_VKL', ref_file=False, description_var=False):
-    """For data visualisation purposes this function can create simple bar plots for any of the variables of accidents"""
+def barplot_accidents(accidents, ref_files, ylabel, groupby='JAAR_VKL', ref_file=False, description_var=False, cube=None):
+    """For data visualisation purposes this function can create simple bar plots for any of the variables of accidents.
+       If an AggregateCube is given and groupby is one of its dimensions, the counts are read from the cube"""
     import matplotlib.pyplot as plt
-    objecttypes_count = accidents.groupby(groupby)['WVK_ID'].count()
+    if cube is not None and groupby in accident_dimensions:
+        objecttypes_count = cube.rollup([groupby], 'n_accidents', {'WVK_ID': pd.notna})
+    else:
+        objecttypes_count = accidents.groupby(groupby)['WVK_ID'].count()
     objecttypes_count = objecttypes_count.sort_values(ascending=True)
     if ref_file:
         plt.barh(ref_files[ref_file].loc[list(objecttypes_count.index)][description_var].iloc[-15:], objecttypes_count.iloc[-15:], color='gray')
@@ -137,59 +370,323 @@ def barplot_accidents(accidents, ref_files, ylabel, groupby='JAAR_VKL', ref_file
     plt.ylabel(ylabel, fontsize=16)
     plt.show()
 
+class Profiler():
+    """Collects timers and counters of the inference steps of HIP, e.g. to find out where the time goes in a batch run.
+       The profiler is off by default, in which case every instrumented step only pays for checking the enabled flag.
+       
+       Usage:
+           HIP.profiler.enable()
+           ... run the assesment ...
+           HIP.profiler.print_summary()
+           HIP.profiler.export('profile.json')"""
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def enable(self, reset=True):
+        if reset:
+            self.reset()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        #Timers map the name of a step to [number of calls, total time in seconds]
+        self.timers = {}
+        self.counters = {}
+
+    def add_time(self, name, seconds):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        """Returns the timers as a Pandas DataFrame (calls, total, mean and share of the total time per step)
+           and the counters as a dictionary. Timers of nested steps are included in the time of the steps that call them"""
+        timers = pd.DataFrame([[name, calls, total] for name, (calls, total) in self.timers.items()], columns=['step', 'calls', 'total_seconds'])
+        timers['mean_ms'] = timers['total_seconds'] / timers['calls'] * 1000
+        timers['share'] = timers['total_seconds'] / timers['total_seconds'].max() if len(timers) > 0 else []
+        timers = timers.sort_values('total_seconds', ascending=False).set_index('step')
+        return timers, dict(sorted(self.counters.items()))
+
+    def print_summary(self):
+        """Printing function"""
+        from tabulate import tabulate
+        timers, counters = self.summary()
+        print(BOLD+'Timers'+END)
+        print(tabulate(timers, headers='keys', floatfmt=('', '.0f', '.4f', '.4f', '.3f')))
+        print(BOLD+'Counters'+END)
+        print(tabulate(list(counters.items()), headers=['counter', 'value']))
+
+    def export(self, filename):
+        """Exports the summary to a json file, which can be compared between batch runs"""
+        timers, counters = self.summary()
+        with open(filename, 'w') as file:
+            json.dump({'timers': timers.reset_index().to_dict(orient='records'), 'counters': counters}, file, indent=2)
+
+profiler = Profiler()
+
+def profiled(name):
+    """Decorator that adds the duration of every call of the decorated function to the timer with the given name, 
+       when the profiler is enabled"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
 
 ###### BELOW YOU CAN FIND ELEMENTS OF THE ACTUAL KNOWLEDGE BASED SYSTEM ######
 
 
+class HIPData(tuple):
+    """The data tuple (accidents, parties, roadsegments, ref_files) as returned by import_data and open_data.
+       It can be unpacked exactly like a normal tuple, but additionally holds the lookup indexes that are used
+       by the retrieval functions. Each index maps an ID to the row positions in the corresponding dataframe.
+       The indexes are built once, on first use, so every later lookup is a dictionary lookup instead of a full scan.
+       They are not updated when the dataframes are changed in place, in that case create a new HIPData from the changed dataframes.
+       The reference files are compiled into code->description dictionaries (reference_tables) when the data is loaded.
+       The other network files (hectopunten, juncties, puntlocaties, ...) are kept in the network dictionary, if they were imported."""
+    def __new__(cls, accidents, parties, roadsegments, ref_files, network=None):
+        return tuple.__new__(cls, (accidents, parties, roadsegments, ref_files))
+
+    def __init__(self, accidents, parties, roadsegments, ref_files, network=None):
+        self.indexes = {}
+        self.reference_tables = compile_ref_files(ref_files)
+        self.network = network
+
+    def __reduce__(self):
+        """Only the dataframes are pickled, the indexes are rebuilt when needed"""
+        return (HIPData, tuple(self) + (self.network,))
+
+    def get_index(self, name):
+        """Returns the lookup index with the given name and builds it if it does not exist yet"""
+        if name not in self.indexes:
+            self.indexes[name] = build_index(self, name)
+        return self.indexes[name]
+
+    def build_indexes(self):
+        """Builds all lookup indexes at once, e.g. before the data is used in an interactive session"""
+        for name in ['accidents', 'parties', 'roadsegments', 'accidents_on_roadsegment', 'columns']:
+            self.get_index(name)
+        return self
+
+def build_index(data, name):
+    """Helper function to build one of the lookup indexes of HIPData:
+        - accidents: str(VKL_NUMMER) -> positions in accidents
+        - parties: str(VKL_NUMMER) -> positions in parties
+        - roadsegments: WVK_ID -> position of the first matching row in roadsegments
+        - accidents_on_roadsegment: WVK_ID -> (date keys, positions in accidents), ordered from old to new (see accident_date_keys)
+        - spatial: the SpatialIndex over the accidents, hectometre posts and junctions
+        - graph: the RoadGraph of the road segments that are connected through junctions
+        - columns: per dataframe the column names and the column arrays, used to extract single rows (see extract_row)
+       Accidents and parties are keyed on the string representation of the ID, just like the original string comparison."""
+    accidents, parties, roadsegments, ref_files = data
+    if name == 'accidents':
+        return group_positions(accidents.index.astype(str))
+    elif name == 'parties':
+        index = {}
+        for accident_ID, positions in group_positions(parties['VKL_NUMMER']).items():
+            key = str(accident_ID)
+            index[key] = np.sort(np.concatenate([index[key], positions])) if key in index else positions
+        return index
+    elif name == 'roadsegments':
+        return {roadsegment_ID: positions[0] for roadsegment_ID, positions in group_positions(roadsegments['WVK_ID']).items()}
+    elif name == 'accidents_on_roadsegment':
+        return group_positions_by_date(accidents['WVK_ID'], accident_date_keys(accidents))
+    elif name == 'spatial':
+        return SpatialIndex(data)
+    elif name == 'graph':
+        return RoadGraph(data)
+    elif name == 'columns':
+        return {frame_name: (list(frame.columns), [frame[column].to_numpy() for column in frame.columns])
+                for frame_name, frame in zip(cache_frames, (accidents, parties, roadsegments))}
+    raise KeyError(f'Unknown index {name}')
+
+def extract_row(data, frame_name, position):
+    """Helper function that returns the row at position of the accidents, parties or roadsegments dataframe as dictionary.
+       The values are taken from the column arrays, which is much faster than selecting (and transposing) a row of a dataframe with mixed types"""
+    columns, arrays = data.get_index('columns')[frame_name]
+    return {column: python_value(array[position]) for column, array in zip(columns, arrays)}
+
+def python_value(value):
+    """Helper function that converts numpy scalars to the corresponding Python values, like the values in a row of a dataframe with mixed types"""
+    if isinstance(value, np.generic):
+        if isinstance(value, (np.datetime64, np.timedelta64)):
+            return pd.Timestamp(value) if isinstance(value, np.datetime64) else pd.Timedelta(value)
+        return value.item()
+    return value
+
+def group_positions(keys):
+    """Helper function that maps every unique (non-empty) key to the array of row positions where it occurs"""
+    return pd.DataFrame({'key': np.asarray(keys)}).groupby('key', sort=False).indices
+
+def group_positions_by_date(keys, date_keys):
+    """Helper function that maps every unique (non-empty) key to its date keys and row positions, ordered on the date.
+       Rows with the same date keep their original order"""
+    keys = np.asarray(keys, dtype='float64')
+    order = np.lexsort((date_keys, keys))
+    order = order[~np.isnan(keys[order])]
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if len(order) > 0 else np.zeros(0, dtype=int)
+    ends = np.r_[starts[1:], len(order)]
+    return {sorted_keys[start]: (date_keys[order[start:end]], order[start:end]) for start, end in zip(starts, ends)}
+
+def accident_date_keys(accidents):
+    """Helper function that converts the date of every accident into a sortable number yyyymmdd.
+       The exact date (DATUM_VKL) is only known for part of the accidents, otherwise the year (JAAR_VKL) and month (MND_NUMMER) are used,
+       with 00 for the unknown month and day. Accidents without any date get the key 0, i.e. they are the oldest"""
+    n_accidents = len(accidents)
+    if 'JAAR_VKL' in accidents:
+        date_keys = pd.to_numeric(accidents['JAAR_VKL'], errors='coerce').to_numpy(dtype='float64') * 10000
+    else:
+        date_keys = np.full(n_accidents, np.nan)
+    if 'MND_NUMMER' in accidents:
+        date_keys = date_keys + np.nan_to_num(pd.to_numeric(accidents['MND_NUMMER'], errors='coerce').to_numpy(dtype='float64')) * 100
+    if 'DATUM_VKL' in accidents:
+        exact_dates = pd.to_numeric(accidents['DATUM_VKL'], errors='coerce').to_numpy(dtype='float64')
+        date_keys = np.where(np.isnan(exact_dates), date_keys, exact_dates)
+    return np.nan_to_num(date_keys).astype('int64')
+
+def prepare_data(data):
+    """Converts a plain (accidents, parties, roadsegments, ref_files) tuple to HIPData, HIPData itself is returned as is.
+       The indexes of a converted plain tuple are not kept between calls, so pass the HIPData returned by
+       import_data or open_data to reuse the indexes"""
+    if isinstance(data, HIPData):
+        return data
+    return HIPData(*data)
+
+@profiled('retrieve_accident_by_ID')
 def retrieve_accident_by_ID(data, accident_ID):
     """This function creates an object of the Accident class.
        It queries the accidents dataframe to obtain the unique accident and related data, i.e. parties and road segment"""
+    data = prepare_data(data)
     accidents, parties, roadsegments, ref_files = data
-    accident_dict = accidents[accidents.index.astype(str)==str(accident_ID)].T.to_dict()[accident_ID]
-    return Accident(accident_dict, accident_ID, data)
+    positions = data.get_index('accidents').get(str(accident_ID), [])
+    if len(positions) == 0 or accidents.index[positions[-1]] != accident_ID:
+        raise KeyError(accident_ID)
+    #If the ID occurs more than once, the last row is used (like the dictionary of all matching rows did before)
+    return Accident(None, accident_ID, data, position=positions[-1])
 
+@profiled('retrieve_road_segment_by_ID')
 def retrieve_road_segment_by_ID(data, roadsegment_ID):
     """This function creates an object of the Roadsegment class.
        It queries the roadsegments dataframe to obtain the unique roadsegment and related data"""
-    accidents, parties, roadsegments, ref_files = data    
+    data = prepare_data(data)
     roadsegment_dict = find_road_segment(data, roadsegment_ID)
     return Roadsegment(roadsegment_dict, roadsegment_ID, data)
     
+@profiled('find_road_segment')
 def find_road_segment(data, roadsegment_ID):
     """Helper function to obtain unique roadsegment"""
+    data = prepare_data(data)
     accidents, parties, roadsegments, ref_files = data
-    wegvak = roadsegments[roadsegments['WVK_ID']==roadsegment_ID] 
-    if wegvak.shape[0] > 0:
-        return wegvak.iloc[0].to_dict()
+    position = data.get_index('roadsegments').get(roadsegment_ID)
+    if position is not None:
+        return extract_row(data, 'roadsegments', position)
     else:
         return {}
     
-def find_accidents_on_roadsegment(data, roadsegment_ID):
-    """This function finds all accidents that happend on a specific road segment.
-       It could be further extended to be able to filter on specific time periods or add additional constraints.
+@profiled('find_accidents_on_roadsegment')
+def find_accidents_on_roadsegment(data, roadsegment_ID, start_year=None, end_year=None, start_date=None, end_date=None, n_accidents=None):
+    """This function finds the accidents that happend on a specific road segment, newest first.
+       Optionally the accidents are filtered on a time period, see query_accidents_on_roadsegment.
+       By default all matching accidents are returned, if n_accidents is given only the n_accidents newest.
+       To go through the accidents page by page, use the AccidentQuery returned by query_accidents_on_roadsegment instead.
        The result is retured in a list of Accidents objects"""
-    accidents, parties, roadsegments, ref_files = data    
-    roadsegment = find_road_segment(data, roadsegment_ID)
-    accidents_on_roadsegment = accidents[accidents['WVK_ID']==roadsegment_ID].T.to_dict()
-    accidents_on_roadsegment_objects = []
-    for i, val in enumerate(accidents_on_roadsegment.items()):
-        if i < extract_first_n_accidents:
-            accident_ID, accident_dict = val
-            accidents_on_roadsegment_objects.append(Accident(accident_dict, accident_ID, data, roadsegment=roadsegment))
-    return accidents_on_roadsegment_objects
+    query = query_accidents_on_roadsegment(data, roadsegment_ID, start_year, end_year, start_date, end_date)
+    return list(query.accidents(n_accidents))
+
+def query_accidents_on_roadsegment(data, roadsegment_ID, start_year=None, end_year=None, start_date=None, end_date=None, newest_first=True):
+    """This function queries the accidents on a specific road segment within a time period.
+       The period is given in years (JAAR_VKL, both inclusive) and/or as dates in the yyyymmdd format of DATUM_VKL (both inclusive).
+       Accidents of which the exact date is unknown are ordered at the start of their month or year, see accident_date_keys.
+
+       The result is an AccidentQuery: a cursor over the matching accidents, ordered newest first by default.
+       No rows are extracted until they are requested with page, fetch or accidents"""
+    data = prepare_data(data)
+    date_keys, positions = data.get_index('accidents_on_roadsegment').get(roadsegment_ID, (np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')))
+    start_key = max(start_year * 10000 if start_year is not None else 0, start_date if start_date is not None else 0)
+    end_key = min(end_year * 10000 + 9999 if end_year is not None else np.iinfo('int64').max, end_date if end_date is not None else np.iinfo('int64').max)
+    positions = positions[np.searchsorted(date_keys, start_key, side='left'):np.searchsorted(date_keys, end_key, side='right')]
+    if newest_first:
+        positions = positions[::-1]
+    return AccidentQuery(data, positions, roadsegment_ID)
+
+class AccidentQuery():
+    """Cursor over the result of a query on the accidents, see query_accidents_on_roadsegment.
+       The matching accidents are only kept as row positions, the rows themselves are extracted per page when they are requested:
+        - len(query): the number of matching accidents
+        - query.page(page_number, page_size): one page of the result as dataframe
+        - query.fetch(n): the next n accidents as dataframe, continuing where the previous fetch stopped
+        - query.accidents(n): generator that creates the Accident objects one by one"""
+    def __init__(self, data, positions, roadsegment_ID=None):
+        self.data = data
+        self.positions = positions
+        self.roadsegment_ID = roadsegment_ID
+        self.offset = 0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def rows(self, start, stop):
+        """Returns the rows start:stop of the result as dataframe"""
+        accidents, parties, roadsegments, ref_files = self.data
+        return accidents.iloc[self.positions[start:stop]]
+
+    def page(self, page_number, page_size=None):
+        """Returns page page_number (starting at 0) of the result as dataframe, the default page_size is extract_first_n_accidents"""
+        page_size = page_size or extract_first_n_accidents
+        return self.rows(page_number * page_size, (page_number + 1) * page_size)
+
+    def fetch(self, n=None):
+        """Returns the next n accidents (by default extract_first_n_accidents) as dataframe, 
+           an empty dataframe is returned when the result is exhausted"""
+        n = n or extract_first_n_accidents
+        rows = self.rows(self.offset, self.offset + n)
+        self.offset = min(self.offset + n, len(self.positions))
+        return rows
+
+    def accidents(self, n=None):
+        """Generator that yields the Accident objects of (the first n accidents of) the result.
+           The Accident objects only extract their row when it is used, so a consumer only pays for what it uses"""
+        stop = len(self.positions) if n is None else min(n, len(self.positions))
+        roadsegment = find_road_segment(self.data, self.roadsegment_ID) if self.roadsegment_ID is not None else False
+        for position in self.positions[:stop]:
+            yield Accident.from_position(self.data, position, roadsegment)
 
+    def __iter__(self):
+        return self.accidents()
+
+@profiled('find_parties')
 def find_parties(data, accident_ID):
     """This function finds all parties involved in a specific accident.
        There is no Party object in HIP. Instead individual parties are stored as dictionaries.
        The reference files are used to enrich the data to descriptions instead of just ID's.
        This helps to make the system user-friendly and the outputs human readible"""
+    data = prepare_data(data)
     accidents, parties, roadsegments, ref_files = data    
-    parties_involved = parties[parties['VKL_NUMMER'].astype(str)==str(accident_ID)].T.to_dict()
+    positions = data.get_index('parties').get(str(accident_ID), [])
+    parties_involved = {python_value(parties.index[position]): extract_row(data, 'parties', position) for position in positions}
     
     for party_id, party_dict in parties_involved.items():
-        parties_involved[party_id]['OTE_OMS'] = determine_value(party_dict['OTE_ID'], ref_files['objecttypes'])
-        parties_involved[party_id]['BWG_OMS_1'] = determine_value(party_dict['BWG_ID_1'], ref_files['bewegingen'])
-        parties_involved[party_id]['BWG_OMS_2'] = determine_value(party_dict['BWG_ID_2'], ref_files['bewegingen'])
+        parties_involved[party_id]['OTE_OMS'] = decode_value(party_dict['OTE_ID'], data.reference_tables['objecttypes'])
+        parties_involved[party_id]['BWG_OMS_1'] = decode_value(party_dict['BWG_ID_1'], data.reference_tables['bewegingen'])
+        parties_involved[party_id]['BWG_OMS_2'] = decode_value(party_dict['BWG_ID_2'], data.reference_tables['bewegingen'])
         
     return parties_involved
 
@@ -201,6 +698,58 @@ def determine_value(ID, reference_file):
     except:
         return "NaN"
 
+def compile_ref_files(ref_files):
+    """Compiles every reference file (including the synthetic intended_movements) into a code->description dictionary.
+       The dictionaries follow determine_value: the description is the first column of the reference file,
+       only numeric codes can be found and codes that occur more than once in a reference file are not decoded"""
+    reference_tables = {}
+    for ref_file_name, reference_file in ref_files.items():
+        if reference_file.shape[1] == 0:
+            reference_tables[ref_file_name] = {}
+            continue
+        codes = reference_file.index
+        unique_codes = ~codes.duplicated(keep=False)
+        numeric_codes = np.array([isinstance(code, (int, float, np.number)) and not isinstance(code, bool) for code in codes], dtype=bool)
+        selection = unique_codes & numeric_codes
+        reference_tables[ref_file_name] = dict(zip(codes[selection], reference_file.iloc[:, 0].to_numpy()[selection]))
+    return reference_tables
+
+missing = object()
+
+def decode_value(ID, reference_table):
+    """Fast equivalent of determine_value that uses a compiled reference table from compile_ref_files.
+       Integer and float codes are found with a single dictionary lookup and empty values (NaN) do not raise an exception"""
+    description = reference_table.get(ID, missing)
+    if description is not missing:
+        return description
+    if ID != ID:
+        return "NaN"
+    try:
+        return reference_table.get(int(ID), "NaN")
+    except (TypeError, ValueError, OverflowError):
+        return "NaN"
+
+def decode_values(IDs, reference_table):
+    """Vectorized counterpart of decode_value for a whole column of IDs.
+       Every unique ID is converted only once, so the result is identical to decoding every row separately"""
+    descriptions = {ID: decode_value(ID, reference_table) for ID in pd.unique(IDs.dropna())}
+    decoded = IDs.map(descriptions).astype(object)
+    decoded[IDs.isna()] = "NaN"
+    return decoded
+
+def decode_data(data):
+    """Adds the decoded descriptions OTE_OMS, BWG_OMS_1 and BWG_OMS_2 to parties and WVG_OMS to accidents as whole columns.
+       A new HIPData is returned, the lookup indexes of data are reused because the rows do not change"""
+    data = prepare_data(data)
+    accidents, parties, roadsegments, ref_files = data
+    accidents = accidents.assign(WVG_OMS=decode_values(accidents['WVG_ID'], data.reference_tables['wegverhardingen']))
+    parties = parties.assign(OTE_OMS=decode_values(parties['OTE_ID'], data.reference_tables['objecttypes']),
+                             BWG_OMS_1=decode_values(parties['BWG_ID_1'], data.reference_tables['bewegingen']),
+                             BWG_OMS_2=decode_values(parties['BWG_ID_2'], data.reference_tables['bewegingen']))
+    decoded_data = HIPData(accidents, parties, roadsegments, ref_files, data.network)
+    decoded_data.indexes = data.indexes
+    return decoded_data
+
 BOLD = '\033[1m'
 END = '\033[0m'
 
@@ -212,27 +761,115 @@ print_all_elements = False
 
 extract_first_n_accidents = 20
 
+elements_from_road = ['Boom', 'Lichtmast', 'Overig vast object', 'Overig wegmeubilair']
+heavy_objects = ['Vrachtauto', 'Trekker', 'Trekker met oplegger', 'Landbouwvoertuig']
+damaging_movements = ['Kantelen', 'Over de kop', 'Uitrollen']
+
+#Decision table of the norms used in the assesment task. Every norm refers to an abstraction of the accident,
+#if the abstraction holds the norm makes its decision. Norms are evaluated in order of priority (lowest first,
+#ties in table order) and the first norm that holds decides the expected damage level.
+#Adding a norm is done by adding a row to this table.
+norms_table = [
+    {'norm': 'involves_damaging_movement', 'priority': 1, 'decision': 'high'},
+    {'norm': 'involves_heavy_object_and_road_element', 'priority': 1, 'decision': 'high'},
+    {'norm': 'involves_element_from_road', 'priority': 2, 'decision': 'medium'},
+    {'norm': 'involves_heavy_object', 'priority': 2, 'decision': 'medium'},
+]
+default_decision = 'undecided'
+
+def compile_norms(norms=None):
+    """Orders the rows of the decision table on their priority, which gives the order in which the norms are evaluated"""
+    if norms is None:
+        norms = norms_table
+    return sorted(norms, key=lambda norm: norm['priority'])
+
+def decide_damage_levels(abstractions, norms=None):
+    """Vectorized evaluation of the decision table.
+       The abstractions are given as a DataFrame (or dictionary) with a column of boolean values per abstraction,
+       the result is an array with the expected damage level of every row."""
+    norms = compile_norms(norms)
+    if len(norms) == 0:
+        return np.full(len(abstractions), default_decision, dtype=object)
+    conditions = [np.asarray(abstractions[norm['norm']], dtype=bool) for norm in norms]
+    return np.select(conditions, [norm['decision'] for norm in norms], default_decision)
+
+#Attributes of Accident that are set by the abstraction step and the assesment task
+abstraction_attributes = ('happend_on_highway', 'involves_element_from_road', 'involves_heavy_object', 'scale_accident',
+                          'involves_heavy_object_and_road_element', 'involves_damaging_movement')
+assesment_attributes = ('expected_damage_level', 'norms', 'n_norms', 'norms_to_evaluate', 'assesment_complete')
+
 class Accident():
-    def __init__(self, dictionary, ID, data, roadsegment=False):
-        """The initialisation function for Acccidents recombines all information into an easy usable object.
+    """An accident with its parties and road segment.
+       To keep many accidents in memory, an Accident only holds a reference to the shared data and its row position.
+       The row dictionary, the parties, the road segment and the assesment are created on first access and then cached.
+       The attributes are declared in __slots__, so an Accident has no per-instance __dict__."""
+    __slots__ = ('ID', 'data', 'position', '_accident', '_roadsegment', '_parties') + abstraction_attributes + assesment_attributes
+
+    def __init__(self, dictionary, ID, data, roadsegment=False, position=None):
+        """The initialisation function for Acccidents only stores the references that are needed to recombine all information later on.
+           Either the row dictionary or the row position in the accidents dataframe is given.
            The accident ID is used to find all parties that were involved in the accident. 
            The roadsegment ID is used to link the accident to the corresponding roadsegment."""
-        accidents, parties, roadsegments, ref_files = data
-        self.accident = dictionary
-        self.accident['WVG_OMS'] = determine_value(self.accident['WVG_ID'], ref_files['wegverhardingen'])
+        self.data = prepare_data(data)
         self.ID = ID
-        if roadsegment:
-            self.roadsegment = roadsegment
-        else:
-            self.roadsegment = find_road_segment(data, int(dictionary['WVK_ID']))
+        self.position = position
+        self._accident = None
+        if dictionary is not None:
+            self._accident = self.decode_accident(dictionary)
+        self._roadsegment = roadsegment if roadsegment else None
+        self._parties = None
+
+    @classmethod
+    def from_position(cls, data, position, roadsegment=False):
+        """Creates the Accident of the row at the given position in the accidents dataframe, without extracting the row"""
+        accidents, parties, roadsegments, ref_files = data
+        return cls(None, accidents.index[position], data, roadsegment, position)
+
+    def decode_accident(self, dictionary):
+        """Helper function that enriches the row dictionary with the description of the road surface"""
+        dictionary['WVG_OMS'] = decode_value(dictionary['WVG_ID'], self.data.reference_tables['wegverhardingen'])
+        return dictionary
+
+    @property
+    def accident(self):
+        if self._accident is None:
+            accidents, parties, roadsegments, ref_files = self.data
+            self._accident = self.decode_accident(extract_row(self.data, 'accidents', self.position))
+        return self._accident
+
+    @property
+    def roadsegment(self):
+        if self._roadsegment is None:
+            self._roadsegment = find_road_segment(self.data, int(self.accident['WVK_ID']))
+        return self._roadsegment
+
+    @property
+    def parties(self):
+        if self._parties is None:
+            self._parties = find_parties(self.data, self.ID)
+        return self._parties
+
+    @property
+    def n_parties(self):
+        return len(self.parties)
+
+    @property
+    def registrationnumber(self):
         try:
-            int_registrationnumber = int(dictionary['REGNUMMER'])
-            self.registrationnumber = str(int_registrationnumber)
+            int_registrationnumber = int(self.accident['REGNUMMER'])
+            return str(int_registrationnumber)
         except:
-            self.registrationnumber = str(dictionary['REGNUMMER'])
-        self.parties = find_parties(data, self.ID)
-        self.n_parties = len(self.parties)
-        self.assesment_task_assess_damage_level()
+            return str(self.accident['REGNUMMER'])
+
+    def __getattr__(self, name):
+        """The abstractions and the result of the assesment task are computed when one of them is accessed for the first time"""
+        if name in abstraction_attributes:
+            self.abstract()
+        elif name in assesment_attributes:
+            self.assesment_task_assess_damage_level()
+        else:
+            raise AttributeError(f"'Accident' object has no attribute '{name}'")
+        return object.__getattribute__(self, name)
 
     def print_accident_details(self, fields_descriptions, fields_to_print):
         """Printing function"""
@@ -272,7 +909,6 @@ class Accident():
 
     def abstract_involves_element_from_road(self):
         """This abstraction step abstracts the fact whether the accident involved an element from the road"""
-        elements_from_road = ['Boom', 'Lichtmast', 'Overig vast object', 'Overig wegmeubilair']
         for party_id, party_dict in self.parties.items():
             if party_dict['OTE_OMS'] in elements_from_road:
                 self.involves_element_from_road = True
@@ -282,7 +918,6 @@ class Accident():
     def abstract_involves_heavy_object(self):
         """This abstraction step abstracts the fact whether the accident involved a heavy object as one of the parties"""
         self.involves_heavy_object = False
-        heavy_objects = ['Vrachtauto', 'Trekker', 'Trekker met oplegger', 'Landbouwvoertuig']
         for party_id, party_dict in self.parties.items():
             if party_dict['OTE_OMS'] in heavy_objects:
                 self.involves_heavy_object = True
@@ -301,7 +936,6 @@ class Accident():
     def abstract_involves_damaging_movement(self):
         """This abstraction step abstracts the fact wheter the accident involved any 
            parties that underwent any damaging movements during the accident"""
-        damaging_movements = ['Kantelen', 'Over de kop', 'Uitrollen']
         self.involves_damaging_movement = False
         for party_id, party_dict in self.parties.items():
             if party_dict['BWG_OMS_1'] in damaging_movements or party_dict['BWG_OMS_2'] in damaging_movements:
@@ -350,54 +984,36 @@ class Accident():
         print(f'  -  Accident is a {self.scale_accident} size scaled accident')
     
     def specify_norms(self):
-        """This function creates the norms to be evaluated for this accident. In the implementation the static norms are included. 
+        """This function creates the norms to be evaluated for this accident. In the implementation the static norms 
+           from the decision table (norms_table) are included, ordered on their priority.
            The function could be extended to include smarter logic that dynamically checks which norms are relevent for this accident.
-           For example, large scale accidents might involve different norms than small scale accidents. 
-           Additionaly the ordering of norms could be specified in this function."""
-        self.norms = ['involves_damaging_movement', 'involves_element_from_road', 'involves_heavy_object', 'involves_heavy_object_and_road_element']
+           For example, large scale accidents might involve different norms than small scale accidents."""
+        self.norms = compile_norms()
         self.n_norms = len(self.norms)
         
     def select_norm(self):
         """This function corresponds to the inference step of selecting norms.
-           It randomly selects one of the norms to evaluate. 
-           If no more norms are left to evaluate it updated appropriate fields and return NaN."""
-        norm = self.norms.pop(random.randint(0,len(self.norms)-1))
+           It selects the norm with the highest priority that has not been evaluated yet. 
+           If no more norms are left to evaluate it updated appropriate fields."""
+        norm = self.norms.pop(0)
         if len(self.norms) == 0:
             self.norms_to_evaluate = False
-            self.assesment_complete = True 
+            self.assesment_complete = True
         return norm
     
     def evaluate_norm(self, norm):
         """For each specific norm the correspoding abstracted case value is evaluated."""
-        if norm == 'involves_element_from_road':
-            return self.involves_element_from_road
-        elif norm == 'involves_heavy_object':
-            return self.involves_heavy_object
-        elif norm == 'involves_heavy_object_and_road_element':
-            return self.involves_heavy_object_and_road_element
-        elif norm == 'involves_damaging_movement':
-            return self.involves_damaging_movement
+        return getattr(self, norm['norm'])
                    
     def match_norm_value(self, norm, norm_value):
         """Based on the norm values obtained in the evaluation step, 
-        the norm values are matched to a decision in this function.
+        the norm values are matched to the decision of the norm in the decision table.
+        Because the norms are evaluated in order of priority, the first norm that holds completes the assesment.
         
-        This logic could be further extended to allow for more complicated accidents to be analyzed.
         If no decision can be made, the result of the assesment is 'undecided'."""
-        if norm == 'involves_element_from_road':
-            if norm_value==True:
-                self.expected_damage_level = 'medium'
-        elif norm == 'involves_heavy_object':
-            if norm_value==True:
-                self.expected_damage_level = 'medium'
-        elif norm == 'involves_heavy_object_and_road_element':
-            if norm_value==True:
-                self.expected_damage_level = 'high'
-                self.assesment_complete = True
-        elif norm == 'involves_damaging_movement':
-            if norm_value==True:
-                self.expected_damage_level = 'high'
-                self.assesment_complete = True
+        if norm_value==True:
+            self.expected_damage_level = norm['decision']
+            self.assesment_complete = True
 
     def assesment_task_assess_damage_level(self, print_log=False):
         """This function is the high level assesment task and follows 
@@ -408,34 +1024,63 @@ class Accident():
            
            Optionally the logging can be printed to demonstrate the inner workings of the method. 
            By default the logging is not printed"""
+        #The inference steps are timed inline, so they pay nothing for the profiler when it is off
+        timed = profiler.enabled
+        if timed:
+            task_start = time.perf_counter()
         if print_log:
             print('------------------------------------------------')
             print(BOLD+'Start assesment task to: determine expected damage level'+END)
         self.abstract()    
+        if timed:
+            profiler.add_time('Accident.abstract', time.perf_counter() - task_start)
         if print_log:
             self.print_abstractions()
+        if timed:
+            step_start = time.perf_counter()
         self.specify_norms()
+        if timed:
+            profiler.add_time('Accident.specify_norms', time.perf_counter() - step_start)
         if print_log:
             print('Specified norms:')
             for norm in self.norms:
-                print(f'   - {norm}')
-        self.expected_damage_level = 'undecided'
+                print(f'   - {norm["norm"]} (priority {norm["priority"]})')
+        self.expected_damage_level = default_decision
         self.norms_to_evaluate=True
         self.assesment_complete=False
         if print_log:
             print('Start norms evaluation')
         norm_i = 1
         while self.norms_to_evaluate and not self.assesment_complete:
+            if timed:
+                step_start = time.perf_counter()
             norm = self.select_norm()
+            if timed:
+                profiler.add_time('Accident.select_norm', time.perf_counter() - step_start)
             if print_log:
-                print(f' -  Selected norm {norm_i} {norm} to evaluate')
+                print(f' -  Selected norm {norm_i} {norm["norm"]} to evaluate')
+            if timed:
+                step_start = time.perf_counter()
             norm_value = self.evaluate_norm(norm)
+            if timed:
+                profiler.add_time('Accident.evaluate_norm', time.perf_counter() - step_start)
             if print_log:
                 print(f'    -  Obtained norm value {norm_value}')
+            if timed:
+                step_start = time.perf_counter()
             self.match_norm_value(norm, norm_value)
+            if timed:
+                profiler.add_time('Accident.match_norm_value', time.perf_counter() - step_start)
             if print_log:
                 print(f'    -  Matched norm value to make decision: {self.expected_damage_level}')
             norm_i+=1
+        if timed:
+            profiler.add_time('Accident.assesment_task_assess_damage_level', time.perf_counter() - task_start)
+            profiler.count('accidents_assessed')
+            profiler.count('norms_evaluated', norm_i-1)
+            profiler.count(f'expected_damage_level.{self.expected_damage_level}')
+            if self.assesment_complete and self.norms_to_evaluate:
+                profiler.count(f'early_exit.{self.expected_damage_level}')
         if print_log:
             print(BOLD+f'Result of assesment task: Expected damage level is {self.expected_damage_level}'+END)
             print('------------------------------------------------')
@@ -445,15 +1090,31 @@ class Roadsegment():
         """The fundamental groundwork for the planning task was performed by introducing the Road segment class.
            The road segment is a piece of the Dutch Highway system. 
            
-           At initaliation the accidents that happened on a road segment are listed in the Roadsegment.accidents variable,
-           such that they are available for further analysis."""
+           At initaliation the accidents that happened on a road segment are queried (see query_accidents_on_roadsegment), 
+           such that they are available for further analysis. Roadsegment.n_accidents is the number of all accidents on the segment,
+           the Accident objects are only created when Roadsegment.accidents or Roadsegment.accidents_page is used."""
         self.roadsegment = roadsegment_dict
         self.ID = roadsegment_ID
+        self.data = prepare_data(data)
         
-        self.accidents = find_accidents_on_roadsegment(data, self.ID)
-        self.n_accidents = len(self.accidents)
+        self.query = query_accidents_on_roadsegment(self.data, self.ID)
+        self.n_accidents = len(self.query)
+        self._accidents = None
     
         self.print_all_elements = False
+
+    @property
+    def accidents(self):
+        """All accidents on the road segment as Accident objects, newest first"""
+        if self._accidents is None:
+            self._accidents = list(self.query.accidents())
+        return self._accidents
+
+    def accidents_page(self, page_number, page_size=None):
+        """Returns page page_number (starting at 0) of the accidents as Accident objects, the default page_size is extract_first_n_accidents"""
+        page_size = page_size or extract_first_n_accidents
+        positions = self.query.positions[page_number * page_size:(page_number + 1) * page_size]
+        return [Accident.from_position(self.data, position, self.roadsegment) for position in positions]
     
     def print_roadsegment_details(self, fields_descriptions, fields_to_print):
         """Printing function"""
@@ -465,15 +1126,1181 @@ class Roadsegment():
                 print('   ' + BOLD+f'{k} '+END+f'{dict_descriptions_roadsegments[k]}: '+BOLD+f'{v}'+END+'\n')
         print('------------------------------------------------')
         
-    def print_accidents_on_roadsegment_details(self, fields_descriptions, fields_to_print):
-        """Printing function"""
+    def print_accidents_on_roadsegment_details(self, fields_descriptions, fields_to_print, page_number=0, page_size=None, print_all=False):
+        """Printing function, prints one page of the accidents (see accidents_page), by default the first page.
+           Every printed accident is assessed, so all accidents are only printed when print_all is True"""
+        from tabulate import tabulate
         dict_descriptions_accidents, dict_descriptions_roadsegments, dict_descriptions_parties = fields_descriptions
         fields_to_print_accidents, fields_to_print_parties, fields_to_print_roadsegments = fields_to_print
         print(BOLD+f'Accidents data ({self.n_accidents} accidents)'+END)
         accidents_print = []
-        for accident in self.accidents:
+        accidents = self.accidents if print_all else self.accidents_page(page_number, page_size)
+        for accident in accidents:
             accidents_print.append([accident.ID, accident.expected_damage_level, accident.n_parties, accident.scale_accident, accident.involves_damaging_movement, accident.involves_element_from_road, accident.involves_heavy_object])
         df_accidents_print = pd.DataFrame(accidents_print)
         df_accidents_print.columns = ['ID', r'Expected damage level', r'N parties', 'Scale', r'Damaging movement', r'Element from road', r'Heavy objects']
         print(tabulate(df_accidents_print, headers='keys'))
         print('------------------------------------------------')
+
+
+@profiled('assess_all')
+def assess_all(data, n_processes=None):
+    """This function performs the assesment task for all accidents at once.
+       Instead of creating an Accident object per row, the abstractions are computed on the parties dataframe
+       as whole columns and aggregated per accident with a single groupby.
+       The norms are then applied to the aggregated abstractions, which gives the same expected damage level
+       as Accident.assesment_task_assess_damage_level().
+
+       If n_processes is given, the accidents are assessed in parallel per road, see assess_all_parallel.
+       The result is a Pandas DataFrame with one row per accident, indexed by VKL_NUMMER"""
+    data = prepare_data(data)
+    accidents, parties, roadsegments, ref_files = data
+    if n_processes:
+        assessment = assess_all_parallel(data, n_processes)
+    else:
+        assessment = assess_accidents(accidents, parties, data.reference_tables)
+    if profiler.enabled:
+        profiler.count('assess_all.accidents_assessed', len(assessment))
+        for level, n in assessment['expected_damage_level'].value_counts().items():
+            profiler.count(f'assess_all.expected_damage_level.{level}', n)
+    return assessment
+
+def assess_accidents(accidents, parties, reference_tables):
+    """Helper function for assess_all that works on (a subset of) the accidents and parties dataframes"""
+    ote_oms = decode_values(parties['OTE_ID'], reference_tables['objecttypes'])
+    bwg_oms_1 = decode_values(parties['BWG_ID_1'], reference_tables['bewegingen'])
+    bwg_oms_2 = decode_values(parties['BWG_ID_2'], reference_tables['bewegingen'])
+
+    party_abstractions = pd.DataFrame({
+        'VKL_NUMMER': parties['VKL_NUMMER'].to_numpy(),
+        'n_parties': 1,
+        'involves_element_from_road': ote_oms.isin(elements_from_road).to_numpy(),
+        'involves_heavy_object': ote_oms.isin(heavy_objects).to_numpy(),
+        'involves_damaging_movement': (bwg_oms_1.isin(damaging_movements) | bwg_oms_2.isin(damaging_movements)).to_numpy()})
+    aggregations = {'n_parties': 'sum', 'involves_element_from_road': 'any', 'involves_heavy_object': 'any', 'involves_damaging_movement': 'any'}
+    per_accident = party_abstractions.groupby('VKL_NUMMER').agg(aggregations)
+    #Parties are linked to accidents on the string representation of the ID, just like in find_parties
+    per_accident = per_accident.groupby(per_accident.index.astype(str)).agg(aggregations)
+    per_accident = per_accident.reindex(accidents.index.astype(str))
+
+    assessment = pd.DataFrame(index=accidents.index)
+    assessment['n_parties'] = per_accident['n_parties'].fillna(0).astype(int).to_numpy()
+    assessment['happend_on_highway'] = (accidents['HECTOMETER'] != 'nan').to_numpy()
+    for abstraction in ['involves_element_from_road', 'involves_heavy_object', 'involves_damaging_movement']:
+        assessment[abstraction] = per_accident[abstraction].eq(True).to_numpy()
+    assessment['scale_accident'] = np.select([assessment['n_parties'] < 3, assessment['n_parties'] <= 4], ['small', 'medium'], 'large')
+    assessment['involves_heavy_object_and_road_element'] = assessment['involves_heavy_object'] & assessment['involves_element_from_road']
+    assessment['expected_damage_level'] = decide_damage_levels(assessment)
+    return assessment
+
+
+###### SPATIAL QUERIES ######
+
+
+#Size of the grid cells of the spatial index in metres (the BRON coordinates are in the Dutch RD system)
+spatial_cell_size = 1000
+
+class SpatialGrid():
+    """Uniform grid over a set of points. The points are sorted on their grid cell, 
+       so all points of a row of cells are one contiguous slice that is found with a binary search.
+       Points without coordinates are left out. Queries return the positions of the points in the original arrays."""
+    def __init__(self, x, y, cell_size=spatial_cell_size):
+        x = np.asarray(x, dtype='float64')
+        y = np.asarray(y, dtype='float64')
+        positions = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        self.cell_size = cell_size
+        if len(positions) == 0:
+            self.x0 = self.y0 = 0.0
+            self.nx = self.ny = 0
+            self.cells = self.x = self.y = self.positions = np.zeros(0)
+            return
+        x, y = x[positions], y[positions]
+        self.x0, self.y0 = x.min(), y.min()
+        ix = ((x - self.x0) // cell_size).astype('int64')
+        iy = ((y - self.y0) // cell_size).astype('int64')
+        self.nx, self.ny = int(ix.max()) + 1, int(iy.max()) + 1
+        cells = iy * self.nx + ix
+        order = np.argsort(cells, kind='stable')
+        self.cells, self.x, self.y, self.positions = cells[order], x[order], y[order], positions[order]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def candidates(self, xmin, ymin, xmax, ymax):
+        """Helper function that returns the (sorted) indices of the points in the grid cells that overlap the bounding box"""
+        ix0 = max(int((xmin - self.x0) // self.cell_size), 0)
+        ix1 = min(int((xmax - self.x0) // self.cell_size), self.nx - 1)
+        iy0 = max(int((ymin - self.y0) // self.cell_size), 0)
+        iy1 = min(int((ymax - self.y0) // self.cell_size), self.ny - 1)
+        if ix0 > ix1 or iy0 > iy1:
+            return np.zeros(0, dtype='int64')
+        rows = np.arange(iy0, iy1 + 1) * self.nx
+        starts = np.searchsorted(self.cells, rows + ix0, side='left')
+        ends = np.searchsorted(self.cells, rows + ix1, side='right')
+        lengths = ends - starts
+        return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+    def query_bbox(self, xmin, ymin, xmax, ymax):
+        """Returns the positions of the points within the bounding box"""
+        candidates = self.candidates(xmin, ymin, xmax, ymax)
+        x, y = self.x[candidates], self.y[candidates]
+        return self.positions[candidates[(x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)]]
+
+    def query_radius(self, x, y, radius):
+        """Returns the positions of the points within the radius around (x, y) and their distances, ordered from near to far"""
+        candidates = self.candidates(x - radius, y - radius, x + radius, y + radius)
+        distances = np.hypot(self.x[candidates] - x, self.y[candidates] - y)
+        within = distances <= radius
+        candidates, distances = candidates[within], distances[within]
+        order = np.argsort(distances, kind='stable')
+        return self.positions[candidates[order]], distances[order]
+
+    def nearest(self, x, y, k=1):
+        """Returns the positions and distances of the k nearest points to (x, y).
+           The search radius is doubled until k points are found, which only visits the cells around the location"""
+        if len(self) == 0:
+            return np.zeros(0, dtype='int64'), np.zeros(0)
+        radius = self.cell_size
+        max_radius = np.hypot(max(abs(x - self.x0), abs(x - self.x0 - self.nx * self.cell_size)),
+                              max(abs(y - self.y0), abs(y - self.y0 - self.ny * self.cell_size)))
+        while True:
+            positions, distances = self.query_radius(x, y, radius)
+            if len(positions) >= k or radius >= max_radius:
+                return positions[:k], distances[:k]
+            radius *= 2
+
+class SpatialIndex():
+    """Spatial index over the accidents, hectometre posts (hectopunten) and junctions (juncties) of the data.
+       The locations are georeferenced with the coordinates in puntlocaties, which are linked through FK_VELD5.
+       Accidents are located on the hectometre post of their WVK_ID and HECTOMETER, and otherwise on their own FK_VELD5.
+       All distances are in metres."""
+    def __init__(self, data, cell_size=spatial_cell_size):
+        accidents, parties, roadsegments, ref_files = data
+        if data.network is None:
+            raise ValueError('The network files are not available, import the data with import_data to use spatial queries')
+        locations = data.network['puntlocaties'].drop_duplicates('FK_VELD5').set_index('FK_VELD5')[['X_COORD', 'Y_COORD']]
+
+        hectopunten = data.network['hectopunten'].drop_duplicates(['WVK_ID', 'HECTOMETER'], keep='last')
+        self.hectopunten = pd.DataFrame({'WVK_ID': hectopunten['WVK_ID'].to_numpy(), 'HECTOMETER': hectopunten['HECTOMETER'].to_numpy()})
+        self.hectopunten[['X_COORD', 'Y_COORD']] = locations.reindex(hectopunten['FK_VELD5']).to_numpy()
+        self.hectopunten_keys = pd.MultiIndex.from_arrays([self.hectopunten['WVK_ID'].astype('float64'), self.hectopunten['HECTOMETER'].astype('float64')])
+
+        juncties = data.network['juncties'].drop_duplicates('JTE_ID', keep='last')
+        self.junctions = pd.DataFrame({'JTE_ID': juncties['JTE_ID'].to_numpy()})
+        self.junctions[['X_COORD', 'Y_COORD']] = locations.reindex(juncties['FK_VELD5']).to_numpy()
+        self.junctions_keys = pd.Index(self.junctions['JTE_ID'])
+
+        #Accidents are joined to the hectometre posts on WVK_ID and HECTOMETER, the others fall back to their own FK_VELD5
+        accident_keys = pd.MultiIndex.from_arrays([accidents['WVK_ID'].astype('float64'), pd.to_numeric(accidents['HECTOMETER'], errors='coerce')])
+        hectopunt_positions = self.hectopunten_keys.get_indexer(accident_keys)
+        accident_xy = np.full((len(accidents), 2), np.nan)
+        matched = hectopunt_positions >= 0
+        accident_xy[matched] = self.hectopunten[['X_COORD', 'Y_COORD']].to_numpy()[hectopunt_positions[matched]]
+        if 'FK_VELD5' in accidents:
+            fallback = np.isnan(accident_xy[:, 0])
+            accident_xy[fallback] = locations.reindex(accidents['FK_VELD5'].to_numpy()[fallback]).to_numpy(dtype='float64')
+        self.accident_xy = accident_xy
+
+        self.accidents_grid = SpatialGrid(accident_xy[:, 0], accident_xy[:, 1], cell_size)
+        self.junctions_grid = SpatialGrid(self.junctions['X_COORD'], self.junctions['Y_COORD'], cell_size)
+
+    def locate_hectopunt(self, roadsegment_ID, hectometer):
+        """Returns the (x, y) coordinates of a hectometre post, or NaN's if it is unknown"""
+        position = self.hectopunten_keys.get_indexer(pd.MultiIndex.from_tuples([(float(roadsegment_ID), float(hectometer))]))[0]
+        if position < 0:
+            return np.nan, np.nan
+        return tuple(self.hectopunten[['X_COORD', 'Y_COORD']].to_numpy()[position])
+
+    def locate_junction(self, junction_ID):
+        """Returns the (x, y) coordinates of a junction, or NaN's if it is unknown"""
+        position = self.junctions_keys.get_indexer([junction_ID])[0]
+        if position < 0:
+            return np.nan, np.nan
+        return tuple(self.junctions[['X_COORD', 'Y_COORD']].to_numpy()[position])
+
+def find_accidents_within_radius(data, x, y, radius, since_year=None):
+    """This function finds all accidents within the radius (in metres) around the location (x, y), 
+       e.g. the location of a hectometre post (locate_hectopunt) or junction (locate_junction).
+       Optionally only accidents since the given year (JAAR_VKL) are included.
+       The accidents are returned as a dataframe ordered from near to far, with the distance in an additional column"""
+    data = prepare_data(data)
+    accidents, parties, roadsegments, ref_files = data
+    positions, distances = data.get_index('spatial').accidents_grid.query_radius(x, y, radius)
+    accidents_nearby = accidents.iloc[positions].assign(DISTANCE=distances)
+    if since_year is not None:
+        accidents_nearby = accidents_nearby[accidents_nearby['JAAR_VKL'] >= since_year]
+    return accidents_nearby
+
+def find_accidents_in_bbox(data, xmin, ymin, xmax, ymax, since_year=None):
+    """This function finds all accidents within the bounding box, optionally only since the given year (JAAR_VKL)"""
+    data = prepare_data(data)
+    accidents, parties, roadsegments, ref_files = data
+    positions = np.sort(data.get_index('spatial').accidents_grid.query_bbox(xmin, ymin, xmax, ymax))
+    accidents_in_bbox = accidents.iloc[positions]
+    if since_year is not None:
+        accidents_in_bbox = accidents_in_bbox[accidents_in_bbox['JAAR_VKL'] >= since_year]
+    return accidents_in_bbox
+
+def find_nearest_junctions(data, x, y, k=1):
+    """This function finds the k nearest junctions to the location (x, y).
+       The result is a dataframe with JTE_ID, X_COORD, Y_COORD and the distance, ordered from near to far"""
+    spatial_index = prepare_data(data).get_index('spatial')
+    positions, distances = spatial_index.junctions_grid.nearest(x, y, k)
+    return spatial_index.junctions.iloc[positions].assign(DISTANCE=distances)
+
+def locate_hectopunt(data, roadsegment_ID, hectometer):
+    """Returns the (x, y) coordinates of the hectometre post on a road segment"""
+    return prepare_data(data).get_index('spatial').locate_hectopunt(roadsegment_ID, hectometer)
+
+def locate_junction(data, junction_ID):
+    """Returns the (x, y) coordinates of a junction"""
+    return prepare_data(data).get_index('spatial').locate_junction(junction_ID)
+
+
+###### ROAD NETWORK GRAPH ######
+
+
+#Number of junctions (hops) over which damage is propagated to neighbouring road segments
+risk_propagation_hops = 2
+#Distance in metres over which the propagated damage decays by a factor e
+risk_decay_distance = 2000
+#Length in metres used for road segments of which the length cannot be derived from the network files
+default_segment_length = 1000
+
+class RoadGraph():
+    """Graph of the road network, in which the road segments (WVK_ID) are the nodes and two road segments are connected
+       if they share a junction (JTE_ID_BEG/JTE_ID_END). The adjacency is stored in compressed sparse row (CSR) form:
+       the neighbours of the segment at position i are indices[indptr[i]:indptr[i+1]], at distances[indptr[i]:indptr[i+1]].
+       The distance between two connected segments is the distance between their midpoints, i.e. half of both lengths.
+       The length of a segment is derived from the kilometres of its junctions in junctiehectometrering, otherwise from
+       the coordinates of its junctions, otherwise default_segment_length is used. All distances are in metres."""
+    def __init__(self, data):
+        accidents, parties, roadsegments, ref_files = data
+        roadsegments = roadsegments[roadsegments['WVK_ID'].notna()].drop_duplicates('WVK_ID').sort_values('WVK_ID')
+        self.roadsegment_IDs = roadsegments['WVK_ID'].to_numpy()
+        self.lengths = segment_lengths(data, roadsegments)
+
+        #Every segment has two ends, segments are connected to all other segments with an end on the same junction
+        n = len(self.roadsegment_IDs)
+        ends = pd.DataFrame({'node': np.tile(np.arange(n), 2),
+                             'junction': np.concatenate([roadsegments['JTE_ID_BEG'].to_numpy(), roadsegments['JTE_ID_END'].to_numpy()])})
+        ends = ends[ends['junction'].notna()]
+        edges = ends.merge(ends, on='junction')
+        edges = edges[edges['node_x'] != edges['node_y']]
+        sources, targets = edges['node_x'].to_numpy(), edges['node_y'].to_numpy()
+        sources, targets, distances = shortest_pairs(sources, targets, (self.lengths[sources] + self.lengths[targets]) / 2, n)
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=n))])
+        self.indices = targets
+        self.distances = distances
+
+    def __len__(self):
+        return len(self.roadsegment_IDs)
+
+    def positions(self, roadsegment_IDs):
+        """Returns the positions of the road segments in the graph, -1 for road segments that are not in the graph"""
+        roadsegment_IDs = np.atleast_1d(np.asarray(roadsegment_IDs, dtype='float64'))
+        if len(self) == 0:
+            return np.full(len(roadsegment_IDs), -1)
+        positions = np.minimum(np.searchsorted(self.roadsegment_IDs, roadsegment_IDs), len(self) - 1)
+        return np.where(self.roadsegment_IDs[positions] == roadsegment_IDs, positions, -1)
+
+    def neighbourhood(self, sources, k=1):
+        """Returns all pairs of (source, target) positions with target within k hops of source (excluding source itself),
+           with the length of the shortest path of at most k hops and the smallest number of hops between them"""
+        sources = np.asarray(sources, dtype='int64')
+        n = len(self)
+        frontier = (sources, sources, np.zeros(len(sources)))
+        reached = [frontier + (np.zeros(len(sources), dtype='int64'),)]
+        for hops in range(1, k + 1):
+            #Extend every path of the frontier with all edges of its last segment
+            starts, ends = self.indptr[frontier[1]], self.indptr[frontier[1] + 1]
+            counts = ends - starts
+            edges = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            frontier = shortest_pairs(np.repeat(frontier[0], counts), self.indices[edges],
+                                      np.repeat(frontier[2], counts) + self.distances[edges], n)
+            if len(frontier[0]) == 0:
+                break
+            reached.append(frontier + (np.full(len(frontier[0]), hops),))
+        sources, targets, distances, hops = (np.concatenate(arrays) for arrays in zip(*reached))
+        other = sources != targets
+        sources, targets, distances, hops = sources[other], targets[other], distances[other], hops[other]
+        min_hops = pd.Series(hops).groupby(sources * n + targets).min()
+        sources, targets, distances = shortest_pairs(sources, targets, distances, n)
+        return sources, targets, distances, min_hops.to_numpy()
+
+    def propagate(self, values, k=risk_propagation_hops, decay_distance=risk_decay_distance):
+        """Returns for every segment the sum of the values of the other segments within k hops,
+           weighted with exp(-distance / decay_distance) of the shortest path between them"""
+        sources, targets, distances, hops = self.neighbourhood(np.arange(len(self)), k)
+        weights = np.asarray(values, dtype='float64')[targets] * np.exp(-distances / decay_distance)
+        return np.bincount(sources, weights=weights, minlength=len(self))
+
+def segment_lengths(data, roadsegments):
+    """Helper function for RoadGraph that derives the length in metres of the road segments"""
+    lengths = np.full(len(roadsegments), np.nan)
+    if data.network is not None:
+        #The kilometre of both junctions along the road of the segment
+        kilometers = data.network['junctiehectometrering'].drop_duplicates(['JTE_ID', 'WEGNUMMER']).set_index(['JTE_ID', 'WEGNUMMER'])['KILOMETER']
+        roads = roadsegments['WEGNUMMER'].astype(object).to_numpy()
+        begin = kilometers.reindex(pd.MultiIndex.from_arrays([roadsegments['JTE_ID_BEG'].to_numpy(), roads])).to_numpy(dtype='float64')
+        end = kilometers.reindex(pd.MultiIndex.from_arrays([roadsegments['JTE_ID_END'].to_numpy(), roads])).to_numpy(dtype='float64')
+        lengths = np.abs(end - begin) * 1000
+
+        #Otherwise the straight line between the coordinates of both junctions
+        locations = data.network['puntlocaties'].drop_duplicates('FK_VELD5').set_index('FK_VELD5')[['X_COORD', 'Y_COORD']]
+        junctions = data.network['juncties'].drop_duplicates('JTE_ID', keep='last').set_index('JTE_ID')['FK_VELD5']
+        begin = locations.reindex(junctions.reindex(roadsegments['JTE_ID_BEG'].to_numpy())).to_numpy(dtype='float64')
+        end = locations.reindex(junctions.reindex(roadsegments['JTE_ID_END'].to_numpy())).to_numpy(dtype='float64')
+        lengths = np.where(np.isnan(lengths), np.hypot(*(end - begin).T), lengths)
+    return np.where(np.isnan(lengths), default_segment_length, lengths)
+
+def shortest_pairs(sources, targets, distances, n):
+    """Helper function that keeps only the shortest distance of every (source, target) pair, ordered by source and target"""
+    order = np.lexsort((distances, targets, sources))
+    sources, targets, distances = sources[order], targets[order], distances[order]
+    first = np.ones(len(sources), dtype=bool)
+    first[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+    return sources[first], targets[first], distances[first]
+
+def find_connected_road_segments(data, roadsegment_ID, k=1):
+    """This function finds the road segments that are connected to a road segment through at most k junctions.
+       The result is a dataframe with the WVK_ID, the number of hops and the distance (in metres, between the midpoints
+       of the segments along the shortest path of at most k hops), ordered from near to far"""
+    graph = prepare_data(data).get_index('graph')
+    position = graph.positions([roadsegment_ID])[0]
+    if position < 0:
+        raise KeyError(roadsegment_ID)
+    sources, targets, distances, hops = graph.neighbourhood([position], k)
+    connected = pd.DataFrame({'WVK_ID': graph.roadsegment_IDs[targets], 'HOPS': hops, 'DISTANCE': distances})
+    return connected.sort_values(['HOPS', 'DISTANCE'], kind='stable').reset_index(drop=True)
+
+def propagate_risk(data, aggregates=None, k=risk_propagation_hops, decay_distance=risk_decay_distance, assessment=None, n_processes=None, cube=None):
+    """This function propagates the expected damage of the road segments (see segment_aggregates) to their neighbours in the road network,
+       such that damage on approach ramps and adjacent segments also raises the priority of a segment.
+       For every road segment the neighbour_risk is the expected damage of the segments within k hops, weighted with
+       exp(-distance / decay_distance). The result is a dataframe indexed by WVK_ID for all road segments of the network,
+       with the own expected_damage, the neighbour_risk and their sum, the propagated_risk."""
+    data = prepare_data(data)
+    if aggregates is None:
+        aggregates = segment_aggregates(data, assessment, n_processes, cube)
+    graph = data.get_index('graph')
+    expected_damage = np.zeros(len(graph))
+    positions = graph.positions(aggregates.index.to_numpy())
+    expected_damage[positions[positions >= 0]] = aggregates['expected_damage'].to_numpy(dtype='float64')[positions >= 0]
+    neighbour_risk = graph.propagate(expected_damage, k, decay_distance)
+    return pd.DataFrame({'expected_damage': expected_damage, 'neighbour_risk': neighbour_risk, 'propagated_risk': expected_damage + neighbour_risk},
+                        index=pd.Index(graph.roadsegment_IDs, name='WVK_ID'))
+
+
+###### PLANNING TASK ######
+
+
+#Weights used to aggregate the expected damage levels of the accidents on a road segment into one priority
+damage_level_weights = {'high': 3, 'medium': 1, 'undecided': 0}
+
+def segment_aggregates(data, assessment=None, n_processes=None, cube=None):
+    """This function aggregates the assessed accidents per road segment (WVK_ID) in one pass.
+       For every highway road segment the number of accidents per expected damage level, the aggregated expected damage
+       and the position on the road (median HECTOMETER of its accidents) are computed.
+       If the assessment is not given, it is computed with assess_all.
+       If n_processes is given, the assessment and the aggregation are done in parallel per road, see segment_aggregates_parallel.
+       If an AggregateCube is given, the aggregates are read from the cube instead of the accidents."""
+    data = prepare_data(data)
+    accidents, parties, roadsegments, ref_files = data
+    if cube is not None:
+        return cube.segment_aggregates(roadsegments.drop_duplicates('WVK_ID').set_index('WVK_ID')[['WEGNUMMER', 'RIJRICHTNG']])
+    if assessment is None:
+        assessment = assess_all(data, n_processes)
+    accidents_assessed = pd.DataFrame({
+        'WVK_ID': accidents['WVK_ID'].to_numpy(),
+        'HECTOMETER': pd.to_numeric(accidents['HECTOMETER'], errors='coerce').to_numpy(),
+        'expected_damage_level': assessment['expected_damage_level'].reindex(accidents.index).to_numpy()})
+    segments = roadsegments.drop_duplicates('WVK_ID').set_index('WVK_ID')[['WEGNUMMER', 'RIJRICHTNG']]
+    if n_processes:
+        return segment_aggregates_parallel(accidents_assessed, segments, n_processes)
+    return aggregate_segments(accidents_assessed, segments)
+
+def aggregate_segments(accidents_assessed, segments):
+    """Helper function for segment_aggregates that aggregates a dataframe with the columns WVK_ID, HECTOMETER and expected_damage_level
+       of (a subset of) the accidents to the given road segments (indexed by WVK_ID)"""
+    return join_segments(aggregate_accidents(accidents_assessed), segments)
+
+def aggregate_accidents(accidents_assessed):
+    """Helper function that aggregates the assessed accidents per WVK_ID"""
+    accidents_assessed = accidents_assessed.assign(expected_damage=accidents_assessed['expected_damage_level'].map(damage_level_weights).fillna(0))
+    for damage_level in damage_level_weights:
+        accidents_assessed['n_'+damage_level] = accidents_assessed['expected_damage_level'] == damage_level
+    return accidents_assessed.groupby('WVK_ID').agg(
+        n_accidents=('expected_damage', 'size'), n_high=('n_high', 'sum'), n_medium=('n_medium', 'sum'), n_undecided=('n_undecided', 'sum'),
+        expected_damage=('expected_damage', 'sum'), HECTOMETER=('HECTOMETER', 'median'))
+
+def join_segments(aggregates, segments):
+    """Helper function that joins the aggregates per WVK_ID to the road segments, in the order of the road segments"""
+    aggregates = aggregates.reindex(segments.index[segments.index.isin(aggregates.index)])
+    return segments.join(aggregates, how='inner')
+
+@profiled('plan_inspections')
+def plan_inspections(data, assessment=None, aggregates=None, n_crews=2, capacity=10, max_route_span=100, n_days=None, min_expected_damage=1, n_processes=None, cube=None,
+                     neighbour_weight=0):
+    """This function implements the planning task: it creates a capacity-constrained inspection schedule for the whole highway network.
+        1. The road segments are ranked on their priority, by default their aggregated expected damage (see segment_aggregates), using a priority queue.
+        2. The road segment with the highest remaining priority starts a new crew route. The route is extended along the same
+           WEGNUMMER and RIJRICHTNG in hectometre order, each time with the neighbouring segment with the highest priority,
+           until the route holds capacity segments or would span more than max_route_span hectometres.
+        3. The routes are scheduled in order of their total priority: every day each of the n_crews crews inspects one route.
+       Only segments with a priority of at least min_expected_damage are planned. If n_days is given, routes that do not fit in the horizon are left out.
+       If n_processes is given, the aggregates are computed in parallel, or if an AggregateCube is given they are read from the cube (see segment_aggregates).
+       If neighbour_weight is given, the segments are ranked on their priority: the expected damage plus neighbour_weight times the
+       damage of the connected road segments (the neighbour_risk of propagate_risk). Only segments with accidents are planned.
+
+       The result is a Pandas DataFrame with one row per road segment to inspect, ordered by day, crew and hectometre."""
+    if aggregates is None:
+        aggregates = segment_aggregates(data, assessment, n_processes, cube)
+    aggregates = aggregates.assign(priority=aggregates['expected_damage'])
+    if neighbour_weight:
+        neighbour_risk = propagate_risk(data, aggregates)['neighbour_risk']
+        aggregates['priority'] += neighbour_weight * neighbour_risk.reindex(aggregates.index).fillna(0).to_numpy()
+    candidates = aggregates[aggregates['priority'] >= min_expected_damage]
+    candidates = candidates.sort_values(['WEGNUMMER', 'RIJRICHTNG', 'HECTOMETER']).reset_index()
+
+    road = (candidates['WEGNUMMER'].astype(str) + '|' + candidates['RIJRICHTNG'].astype(str)).to_numpy()
+    hectometer = candidates['HECTOMETER'].to_numpy()
+    priority = candidates['priority'].to_numpy()
+    route_of_segment = np.full(len(candidates), -1)
+
+    #Priority queue of all candidate segments, segments that are already part of a route are skipped when popped
+    queue = [(-damage, position) for position, damage in enumerate(priority)]
+    heapq.heapify(queue)
+    routes = []
+    while queue:
+        negative_damage, position = heapq.heappop(queue)
+        if route_of_segment[position] >= 0:
+            continue
+        route_ID = len(routes)
+        route_of_segment[position] = route_ID
+        first, last = position, position
+        while last - first + 1 < capacity:
+            options = []
+            for neighbour in (first - 1, last + 1):
+                if 0 <= neighbour < len(candidates) and route_of_segment[neighbour] < 0 and road[neighbour] == road[position]:
+                    span = max(hectometer[last], hectometer[neighbour]) - min(hectometer[first], hectometer[neighbour])
+                    if span <= max_route_span:
+                        options.append((priority[neighbour], neighbour))
+            if not options:
+                break
+            damage, neighbour = max(options)
+            route_of_segment[neighbour] = route_ID
+            first, last = min(first, neighbour), max(last, neighbour)
+        routes.append(priority[first:last+1].sum())
+
+    #Routes are scheduled in order of their total priority, one route per crew per day
+    route_order = np.argsort(-np.array(routes), kind='stable')
+    route_rank = np.empty(len(routes), dtype=int)
+    route_rank[route_order] = np.arange(len(routes))
+    schedule = candidates.assign(route=route_rank[route_of_segment], route_priority=np.array(routes)[route_of_segment])
+    schedule['route_expected_damage'] = schedule.groupby('route')['expected_damage'].transform('sum')
+    schedule['day'] = schedule['route'] // n_crews + 1
+    schedule['crew'] = schedule['route'] % n_crews + 1
+    if n_days is not None:
+        schedule = schedule[schedule['day'] <= n_days]
+    schedule = schedule.sort_values(['day', 'crew', 'HECTOMETER']).reset_index(drop=True)
+    return schedule[['day', 'crew', 'route', 'WEGNUMMER', 'RIJRICHTNG', 'WVK_ID', 'HECTOMETER', 'n_accidents', 'n_high', 'n_medium',
+                     'expected_damage', 'route_expected_damage', 'priority', 'route_priority']]
+
+
+###### AGGREGATION CUBE ######
+
+
+#Dimensions of the aggregation cube. Accidents are counted per accident_dimensions, parties per party_dimensions.
+accident_dimensions = ['WVK_ID', 'WEGNUMMER', 'JAAR_VKL', 'expected_damage_level']
+party_dimensions = ['WVK_ID', 'WEGNUMMER', 'JAAR_VKL', 'expected_damage_level', 'OTE_ID']
+
+class AggregateCube():
+    """Materialised counts of the accidents and parties per road segment, road, year, expected damage level and object type.
+       The cube is built once from the (assessed) data and serves roll-ups and slices without going back to the rows:
+        - cube.rollup(['JAAR_VKL']): number of accidents per year
+        - cube.rollup(['OTE_ID'], 'n_parties', {'WEGNUMMER': 'A2'}): number of parties per object type on the A2
+        - cube.segment_aggregates(segments): the aggregates per road segment that are used by the planning task
+       Roll-ups are kept until the cube changes, so asking the same roll-up again is a dictionary lookup.
+       The aggregates per road segment are stored as well, with the median hectometre of the accidents, which is computed
+       from a histogram of the hectometres per road segment.
+       When accidents are added or removed (e.g. a new year of BRON) the cube is updated with add and remove,
+       which only aggregates the changed accidents and only recomputes the road segments they are on."""
+    def __init__(self, accident_cells=None, party_cells=None, hectometers=None):
+        self.accident_cells = accident_cells if accident_cells is not None else pd.DataFrame(columns=accident_dimensions + ['n_accidents'])
+        self.party_cells = party_cells if party_cells is not None else pd.DataFrame(columns=party_dimensions + ['n_parties'])
+        self.hectometers = hectometers if hectometers is not None else pd.DataFrame(columns=['WVK_ID', 'HECTOMETER', 'n_accidents'])
+        self.segments = cube_segments(self.accident_cells, self.hectometers)
+        self.rollups = {}
+        self.codes = {}
+
+    @classmethod
+    def from_data(cls, data, assessment=None):
+        """Builds the cube for all accidents and parties of data. If the assessment is not given, it is computed with assess_all"""
+        data = prepare_data(data)
+        accidents, parties, roadsegments, ref_files = data
+        if assessment is None:
+            assessment = assess_all(data)
+        return cls(*cube_cells(accidents, parties, roadsegments, assessment))
+
+    def add(self, accidents, parties, roadsegments, assessment, sign=1):
+        """Adds the counts of new accidents and their parties to the cube"""
+        accident_cells, party_cells, hectometers = cube_cells(accidents, parties, roadsegments, assessment)
+        for cells, measure in [(accident_cells, 'n_accidents'), (party_cells, 'n_parties'), (hectometers, 'n_accidents')]:
+            cells[measure] = sign * cells[measure]
+        self.accident_cells = merge_cells(self.accident_cells, accident_cells, accident_dimensions, 'n_accidents')
+        self.party_cells = merge_cells(self.party_cells, party_cells, party_dimensions, 'n_parties')
+        self.hectometers = merge_cells(self.hectometers, hectometers, ['WVK_ID', 'HECTOMETER'], 'n_accidents')
+
+        #Only the road segments of the changed accidents are recomputed
+        changed = accident_cells['WVK_ID'].dropna().unique()
+        segments = cube_segments(self.accident_cells[self.accident_cells['WVK_ID'].isin(changed)],
+                                 self.hectometers[self.hectometers['WVK_ID'].isin(changed)])
+        kept = self.segments[~self.segments.index.isin(changed)]
+        self.segments = pd.concat([kept, segments]).sort_index() if len(kept) > 0 and len(segments) > 0 else (segments if len(kept) == 0 else kept)
+        self.rollups = {}
+        self.codes = {}
+        return self
+
+    def remove(self, accidents, parties, roadsegments, assessment):
+        """Removes the counts of accidents and their parties from the cube, e.g. before they are added again with changed values"""
+        return self.add(accidents, parties, roadsegments, assessment, sign=-1)
+
+    def cells(self, measure='n_accidents', filters=None):
+        """Returns the cells of the cube for the measure ('n_accidents' or 'n_parties'), optionally only the slice selected by filters.
+           The filters map a dimension to a value, a list of values or a function that selects values, e.g. {'WVK_ID': pd.notna}"""
+        cells = self.accident_cells if measure == 'n_accidents' else self.party_cells
+        for dimension, selection in (filters or {}).items():
+            check_dimension(dimension, measure)
+            cells = cells[select_values(cells[dimension], selection)]
+        return cells
+
+    def rollup(self, dimensions=(), measure='n_accidents', filters=None):
+        """Sums the measure over all dimensions except the given ones. Just like a groupby on the rows, empty values of the
+           given dimensions are left out. Without dimensions the total is returned.
+           The sums are computed on the integer codes of the dimensions (see dimension_codes) and kept until the cube changes"""
+        key = rollup_key(dimensions, measure, filters)
+        if key is None or key not in self.rollups:
+            rollup = self.compute_rollup(list(dimensions), measure, filters)
+            if key is None:
+                return rollup
+            self.rollups[key] = rollup
+        rollup = self.rollups[key]
+        return rollup.copy() if isinstance(rollup, pd.Series) else rollup
+
+    def compute_rollup(self, dimensions, measure, filters):
+        """Helper function for rollup that sums the measure per combination of the codes of the dimensions"""
+        cells = self.accident_cells if measure == 'n_accidents' else self.party_cells
+        codes = self.dimension_codes(measure)
+        values = cells[measure].to_numpy()
+        mask = np.ones(len(cells), dtype=bool)
+        for dimension, selection in (filters or {}).items():
+            check_dimension(dimension, measure)
+            dimension_codes, uniques = codes[dimension]
+            #The selection is evaluated once per unique value, the last option is the empty value (code -1)
+            options = pd.Series(np.append(uniques, np.nan))
+            mask &= select_values(options, selection)[dimension_codes]
+        if len(dimensions) == 0:
+            return values[mask].sum()
+        for dimension in dimensions:
+            check_dimension(dimension, measure)
+            mask &= codes[dimension][0] >= 0
+        shape = [max(len(codes[dimension][1]), 1) for dimension in dimensions]
+        keys = np.ravel_multi_index([codes[dimension][0][mask] for dimension in dimensions], shape)
+        if np.prod(shape, dtype='float64') <= max(4 * len(cells), 2**16):
+            #Few combinations: sum directly per combination and keep the combinations that occur
+            sums = np.bincount(keys, weights=values[mask], minlength=int(np.prod(shape)))
+            keys = np.flatnonzero(np.bincount(keys, minlength=int(np.prod(shape))))
+            sums = sums[keys].astype(values.dtype)
+        else:
+            keys, groups = np.unique(keys, return_inverse=True)
+            sums = np.bincount(groups.ravel(), weights=values[mask], minlength=len(keys)).astype(values.dtype)
+        labels = np.unravel_index(keys, shape)
+        labels = [codes[dimension][1][label] for dimension, label in zip(dimensions, labels)]
+        if len(dimensions) == 1:
+            index = pd.Index(labels[0], name=dimensions[0])
+        else:
+            index = pd.MultiIndex.from_arrays(labels, names=dimensions)
+        return pd.Series(sums, index=index, name=measure)
+
+    def dimension_codes(self, measure):
+        """Returns per dimension the integer codes of the cells and the sorted unique values, empty values have code -1"""
+        if measure not in self.codes:
+            cells = self.accident_cells if measure == 'n_accidents' else self.party_cells
+            dimensions = accident_dimensions if measure == 'n_accidents' else party_dimensions
+            self.codes[measure] = {dimension: pd.factorize(cells[dimension].to_numpy(), sort=True) for dimension in dimensions}
+        return self.codes[measure]
+
+    def segment_aggregates(self, segments):
+        """Returns the same aggregates per road segment as segment_aggregates, from the cube instead of the accidents.
+           segments is indexed by WVK_ID with the WEGNUMMER and RIJRICHTNG columns, see segment_aggregates"""
+        return join_segments(self.segments, segments)
+
+def cube_cells(accidents, parties, roadsegments, assessment):
+    """Helper function that aggregates accidents and parties into the cells of the aggregation cube,
+       and the accidents into the histogram of the hectometres per road segment.
+       Parties are linked to their accident on the string representation of the ID (like find_parties), 
+       parties without a (highway) accident are counted with empty accident dimensions"""
+    roads = roadsegments.drop_duplicates('WVK_ID').set_index('WVK_ID')['WEGNUMMER'].astype(object)
+    accident_facts = pd.DataFrame({
+        'WVK_ID': pd.to_numeric(accidents['WVK_ID'], errors='coerce').to_numpy(dtype='float64'),
+        'JAAR_VKL': pd.to_numeric(accidents['JAAR_VKL'], errors='coerce').to_numpy(dtype='float64') if 'JAAR_VKL' in accidents else np.nan,
+        'expected_damage_level': assessment['expected_damage_level'].reindex(accidents.index).to_numpy(dtype=object)})
+    accident_facts.insert(1, 'WEGNUMMER', roads.reindex(accident_facts['WVK_ID']).to_numpy())
+    accident_cells = accident_facts.groupby(accident_dimensions, dropna=False).size().rename('n_accidents').reset_index()
+
+    hectometers = pd.DataFrame({'WVK_ID': accident_facts['WVK_ID'], 'HECTOMETER': pd.to_numeric(accidents['HECTOMETER'], errors='coerce').to_numpy(dtype='float64')})
+    hectometers = hectometers.dropna().groupby(['WVK_ID', 'HECTOMETER']).size().rename('n_accidents').reset_index()
+
+    accident_keys = pd.Index(accidents.index.astype(str))
+    first_positions = pd.Series(np.arange(len(accidents))).groupby(accident_keys.to_numpy(), sort=False).first()
+    party_positions = first_positions.reindex(parties['VKL_NUMMER'].astype(str).to_numpy()).to_numpy()
+    party_facts = accident_facts.reindex(party_positions).reset_index(drop=True)
+    party_facts['OTE_ID'] = pd.to_numeric(parties['OTE_ID'], errors='coerce').to_numpy(dtype='float64')
+    party_cells = party_facts.groupby(party_dimensions, dropna=False).size().rename('n_parties').reset_index()
+    return accident_cells, party_cells, hectometers
+
+def cube_segments(accident_cells, hectometers):
+    """Helper function that computes the aggregates per road segment (see aggregate_accidents) from the accident cells,
+       with the median hectometre from the histogram of the hectometres"""
+    cells = accident_cells[accident_cells['WVK_ID'].notna()]
+    cells = cells.assign(expected_damage=cells['expected_damage_level'].map(damage_level_weights).fillna(0) * cells['n_accidents'])
+    for damage_level in damage_level_weights:
+        cells['n_'+damage_level] = cells['n_accidents'].where(cells['expected_damage_level'] == damage_level, 0)
+    segments = cells.groupby('WVK_ID').agg(
+        n_accidents=('n_accidents', 'sum'), n_high=('n_high', 'sum'), n_medium=('n_medium', 'sum'), n_undecided=('n_undecided', 'sum'),
+        expected_damage=('expected_damage', 'sum'))
+    segments['HECTOMETER'] = weighted_median(hectometers, 'WVK_ID', 'HECTOMETER', 'n_accidents')
+    return segments
+
+def check_dimension(dimension, measure):
+    """Helper function that raises a KeyError if the dimension is not a dimension of the measure"""
+    dimensions = accident_dimensions if measure == 'n_accidents' else party_dimensions
+    if dimension not in dimensions:
+        raise KeyError(f'{dimension} is not a dimension of {measure}, use one of {dimensions}')
+
+def select_values(values, selection):
+    """Helper function that returns the boolean mask of the values selected by a filter of the cube (a value, a list of values or a function)"""
+    if callable(selection):
+        return np.asarray(selection(values), dtype=bool)
+    elif isinstance(selection, (list, tuple, set, np.ndarray, pd.Index)):
+        return values.isin(list(selection)).to_numpy()
+    return (values == selection).to_numpy()
+
+def rollup_key(dimensions, measure, filters):
+    """Helper function that returns the key under which a roll-up is kept, or None if the filters cannot be used as key"""
+    try:
+        key = (tuple(dimensions), measure, tuple((dimension, tuple(selection) if isinstance(selection, (list, tuple, set, np.ndarray, pd.Index)) else selection)
+                                                for dimension, selection in sorted((filters or {}).items())))
+        hash(key)
+        return key
+    except TypeError:
+        return None
+
+def merge_cells(cells, new_cells, dimensions, measure):
+    """Helper function that adds new_cells to cells, cells of which the count becomes zero are removed"""
+    if len(cells) == 0:
+        merged = new_cells
+    else:
+        merged = pd.concat([cells, new_cells]).groupby(dimensions, dropna=False)[measure].sum().reset_index()
+    return merged[merged[measure] != 0].reset_index(drop=True)
+
+def weighted_median(cells, group, value, weight):
+    """Helper function that computes the median of the values per group, where every value occurs weight times.
+       This is the same median as that of the original rows, empty values are left out"""
+    cells = cells[cells[value].notna() & (cells[weight] > 0)]
+    cells = cells.groupby([group, value])[weight].sum().reset_index()
+    if len(cells) == 0:
+        return pd.Series(dtype='float64')
+    groups, starts, sizes = np.unique(cells[group].to_numpy(), return_index=True, return_counts=True)
+    ends = np.cumsum(cells[weight].to_numpy())
+    offsets = np.r_[0, ends][starts]
+    totals = np.r_[0, ends][starts + sizes] - offsets
+    values = cells[value].to_numpy()
+    lower = values[np.searchsorted(ends, offsets + (totals - 1) // 2, side='right')]
+    upper = values[np.searchsorted(ends, offsets + totals // 2, side='right')]
+    return pd.Series((lower + upper) / 2, index=groups)
+
+
+###### PARALLEL EXECUTION ######
+
+
+#The accidents of one road are independent of the accidents of other roads, so the bulk assesment and the aggregation
+#are split into shards of whole roads (WEGNUMMER) that are processed by a pool of processes.
+#The columns that are needed are copied once into shared memory, the tasks only receive the boundaries of their shard.
+#Per process there are shards_per_process shards, so the work is still balanced when some roads are much busier than others.
+shards_per_process = 4
+
+def assess_all_parallel(data, n_processes=None):
+    """Parallel version of assess_all, the result is exactly the same as the serial assesment.
+       The accidents are sharded by road, and every party follows its accident. 
+       The shards are assessed with assess_accidents in a process pool and the results are merged back into the original order.
+       The key columns (VKL_NUMMER, HECTOMETER, OTE_ID, BWG_ID_1 and BWG_ID_2) have to be numeric, otherwise the serial assesment is used."""
+    data = prepare_data(data)
+    accidents, parties, roadsegments, ref_files = data
+    n_processes = n_processes or os.cpu_count()
+    columns = {'accident_IDs': accidents.index, 'HECTOMETER': accidents['HECTOMETER'], 'VKL_NUMMER': parties['VKL_NUMMER'],
+               'OTE_ID': parties['OTE_ID'], 'BWG_ID_1': parties['BWG_ID_1'], 'BWG_ID_2': parties['BWG_ID_2']}
+    if len(accidents) == 0 or any(np.asarray(column).dtype.kind not in 'biuf' for column in columns.values()):
+        return assess_accidents(accidents, parties, data.reference_tables)
+
+    accident_shards = road_shards(accidents, roadsegments, n_processes * shards_per_process)
+    #All rows of an accident ID (and so all of its parties) are placed in the shard of the first row with that ID
+    accident_keys = accidents.index.astype(str)
+    key_shards = pd.Series(accident_shards).groupby(accident_keys, sort=False).first()
+    accident_shards = key_shards.reindex(accident_keys).to_numpy()
+    party_shards = key_shards.reindex(parties['VKL_NUMMER'].astype(str)).fillna(-1).astype(int).to_numpy()
+    n_shards = int(accident_shards.max()) + 1
+    accident_order, accident_bounds = shard_order(accident_shards, n_shards)
+    party_order, party_bounds = shard_order(party_shards, n_shards)
+
+    arrays = {name: np.asarray(column)[accident_order if name in ['accident_IDs', 'HECTOMETER'] else party_order] for name, column in columns.items()}
+    tasks = [(accident_bounds[i], accident_bounds[i+1], party_bounds[i], party_bounds[i+1]) for i in range(len(accident_bounds) - 1)]
+    results = run_sharded(assess_shard, arrays, tasks, n_processes, data.reference_tables)
+    assessment = pd.concat([result for result in results if result is not None])
+    #Back to the original order of the accidents
+    assessment = assessment.iloc[np.argsort(accident_order, kind='stable')]
+    assessment.index = accidents.index
+    return assessment
+
+def assess_shard(task):
+    """Task of assess_all_parallel: assesses the accidents and parties of one shard from the shared arrays"""
+    accident_start, accident_stop, party_start, party_stop = task
+    if accident_start == accident_stop:
+        return None
+    arrays = worker_arrays
+    accidents = pd.DataFrame({'HECTOMETER': arrays['HECTOMETER'][accident_start:accident_stop]},
+                             index=pd.Index(arrays['accident_IDs'][accident_start:accident_stop], name='VKL_NUMMER'))
+    parties = pd.DataFrame({name: arrays[name][party_start:party_stop] for name in ['VKL_NUMMER', 'OTE_ID', 'BWG_ID_1', 'BWG_ID_2']})
+    return assess_accidents(accidents, parties, worker_context)
+
+def segment_aggregates_parallel(accidents_assessed, segments, n_processes=None):
+    """Parallel version of aggregate_segments, the result is exactly the same as the serial aggregation.
+       All accidents of a road segment are in the same shard, so the aggregates of the shards only have to be concatenated"""
+    n_processes = n_processes or os.cpu_count()
+    if len(accidents_assessed) == 0:
+        return aggregate_segments(accidents_assessed, segments)
+    roads = segments['WEGNUMMER'].reindex(accidents_assessed['WVK_ID'])
+    accident_shards = balance_shards(roads, n_processes * shards_per_process)
+    accident_order, accident_bounds = shard_order(accident_shards, int(accident_shards.max()) + 1)
+
+    damage_levels = list(damage_level_weights)
+    levels = pd.Categorical(accidents_assessed['expected_damage_level'], categories=damage_levels).codes
+    arrays = {'WVK_ID': accidents_assessed['WVK_ID'].to_numpy(dtype='float64')[accident_order],
+              'HECTOMETER': accidents_assessed['HECTOMETER'].to_numpy(dtype='float64')[accident_order],
+              'expected_damage_level': levels[accident_order]}
+    tasks = [(accident_bounds[i], accident_bounds[i+1]) for i in range(len(accident_bounds) - 1)]
+    results = run_sharded(aggregate_shard, arrays, tasks, n_processes, damage_levels)
+    aggregates = pd.concat([result for result in results if result is not None])
+    aggregates.index = aggregates.index.astype(accidents_assessed['WVK_ID'].dtype)
+    return join_segments(aggregates, segments)
+
+def aggregate_shard(task):
+    """Task of segment_aggregates_parallel: aggregates the accidents of one shard from the shared arrays"""
+    start, stop = task
+    if start == stop:
+        return None
+    arrays = worker_arrays
+    levels = arrays['expected_damage_level'][start:stop]
+    accidents_assessed = pd.DataFrame({'WVK_ID': arrays['WVK_ID'][start:stop], 'HECTOMETER': arrays['HECTOMETER'][start:stop],
+                                       'expected_damage_level': np.where(levels >= 0, np.array(worker_context, dtype=object)[levels], np.nan)})
+    return aggregate_accidents(accidents_assessed)
+
+def road_shards(accidents, roadsegments, n_shards):
+    """Helper function that assigns every accident to a shard based on the road (WEGNUMMER) of its road segment"""
+    roads = roadsegments.drop_duplicates('WVK_ID').set_index('WVK_ID')['WEGNUMMER']
+    return balance_shards(roads.reindex(accidents['WVK_ID'].to_numpy()), n_shards)
+
+def balance_shards(roads, n_shards):
+    """Helper function that divides the roads over n_shards shards with about the same number of accidents.
+       The busiest roads are placed first, each time in the shard with the fewest accidents so far.
+       Accidents without a known road are grouped as one extra road. Returns the shard of every accident"""
+    roads = pd.Series(np.asarray(roads, dtype=object)).fillna('').astype(str).to_numpy()
+    road_names, road_of_accident, road_sizes = np.unique(roads, return_inverse=True, return_counts=True)
+    shard_loads = [(0, shard) for shard in range(min(n_shards, len(road_names)))]
+    shard_of_road = np.zeros(len(road_names), dtype=int)
+    for road in sorted(range(len(road_names)), key=lambda road: (-road_sizes[road], road_names[road])):
+        load, shard = heapq.heappop(shard_loads)
+        shard_of_road[road] = shard
+        heapq.heappush(shard_loads, (load + road_sizes[road], shard))
+    return shard_of_road[road_of_accident]
+
+def shard_order(shards, n_shards):
+    """Helper function that returns the (stable) order that sorts the rows on their shard, and the boundaries of every shard in that order.
+       Rows with shard -1 are left out"""
+    order = np.argsort(shards, kind='stable')
+    order = order[shards[order] >= 0]
+    bounds = np.searchsorted(shards[order], np.arange(n_shards + 1))
+    return order, bounds
+
+def run_sharded(task_function, arrays, tasks, n_processes, context):
+    """Helper function that copies the arrays into shared memory once and runs the tasks in a process pool.
+       Every process attaches to the shared memory when it starts, so only the task boundaries and the results are pickled.
+       The results are returned in the order of the tasks, independent of which process finishes first"""
+    blocks = []
+    specs = {}
+    try:
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            specs[name] = (block.name, array.shape, array.dtype.str)
+        with multiprocessing.Pool(n_processes, initializer=attach_shared_arrays, initargs=(specs, context)) as pool:
+            return pool.map(task_function, tasks, chunksize=1)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+worker_blocks = {}
+worker_arrays = {}
+worker_context = None
+
+def attach_shared_arrays(specs, context):
+    """Initializer of the processes of run_sharded: attaches the shared arrays without copying them"""
+    global worker_arrays, worker_context
+    for name, (block_name, shape, dtype) in specs.items():
+        worker_blocks[name] = attach_shared_memory(block_name)
+        worker_arrays[name] = np.ndarray(shape, dtype=dtype, buffer=worker_blocks[name].buf)
+    worker_context = context
+
+def attach_shared_memory(block_name):
+    """Helper function that attaches to an existing shared memory block that is owned (and unlinked) by the parent process"""
+    try:
+        return shared_memory.SharedMemory(name=block_name, track=False)
+    except TypeError:
+        #The track argument only exists since Python 3.13, before that the pool shares the resource tracker of the parent process
+        return shared_memory.SharedMemory(name=block_name)
+
+
+###### INCREMENTAL ASSESSMENT ######
+
+
+def row_hashes(frame):
+    """Helper function that computes a content hash per row (including the index) of a dataframe.
+       Numeric columns are hashed as float64, so the hash does not depend on whether Pandas inferred a column as int or float"""
+    numeric_columns = [column for column in frame.columns if pd.api.types.is_numeric_dtype(frame[column].dtype) and not pd.api.types.is_bool_dtype(frame[column].dtype)]
+    return pd.util.hash_pandas_object(frame.astype({column: 'float64' for column in numeric_columns}), index=True)
+
+def reference_tables_hash(reference_tables):
+    """Helper function that fingerprints the reference tables used by the assessment"""
+    used_tables = {name: sorted((repr(code), repr(description)) for code, description in reference_tables[name].items())
+                   for name in ['objecttypes', 'bewegingen']}
+    return hashlib.sha1(repr(used_tables).encode('utf-8')).hexdigest()
+
+class AssessmentStore():
+    def __init__(self, filename=None):
+        """The assessment store keeps the result of the assessment task for every accident, keyed by VKL_NUMMER,
+           together with a content hash of the accident row and of its parties. The per-segment aggregates
+           used by the planning task (see segment_aggregates) are kept as well.
+
+           When a new BRON export arrives, refresh() only re-imports and re-assesses the accidents that are new or
+           whose accident row or parties changed, and only updates the aggregates of the road segments involved.
+           If a filename is given and exists, the store is loaded from that file."""
+        self.filename = filename
+        self.assessment = None
+        self.aggregates = None
+        self.segments = None
+        self.reference_hash = None
+        if filename is not None and Path(filename).exists():
+            with open(filename, 'rb') as f:
+                self.__dict__.update(pickle.load(f))
+            self.filename = filename
+
+    def save(self, filename=None):
+        """Saves the store to a pickle file, by default to the file it was loaded from"""
+        self.filename = filename or self.filename
+        with open(self.filename, 'wb') as f:
+            pickle.dump({'assessment': self.assessment, 'aggregates': self.aggregates, 'segments': self.segments,
+                         'reference_hash': self.reference_hash}, f)
+
+    def refresh(self, foldername, chunksize=100000):
+        """Brings the store up to date with the BRON export in foldername and returns the number of new, changed, removed and unchanged accidents.
+           The accident and party files are streamed twice at most (see import_data_streaming for the filters and dtypes):
+            - all rows are hashed, but only the rows of new or changed accidents are kept in memory
+            - parties are only kept for accidents that need to be re-assessed
+           The re-assessment and the update of the aggregates are therefore proportional to the size of the change."""
+        ref_files = import_ref_files(foldername)
+        reference_tables = compile_ref_files(ref_files)
+        reference_hash = reference_tables_hash(reference_tables)
+        if reference_hash != self.reference_hash:
+            #Other reference files can change every assessment, so the stored results and aggregates cannot be reused
+            self.assessment = None
+            self.aggregates = None
+            self.segments = None
+            self.reference_hash = reference_hash
+        if self.assessment is None:
+            stored = pd.DataFrame({'WVK_ID': pd.Series(dtype='float64'), 'HECTOMETER': pd.Series(dtype='float64'),
+                                   'accident_hash': pd.Series(dtype='uint64'), 'parties_hash': pd.Series(dtype='uint64')})
+        else:
+            stored = self.assessment
+
+        accident_hashes = []
+        def keep_changed_accidents(chunk):
+            chunk = chunk[chunk['HECTOMETER'].notna()]
+            chunk_hashes = row_hashes(chunk.set_index('VKL_NUMMER'))
+            accident_hashes.append(chunk_hashes)
+            return chunk[chunk_hashes.to_numpy() != stored['accident_hash'].reindex(chunk_hashes.index, fill_value=0).to_numpy()]
+        changed_accidents = read_csv_filtered(Path(foldername, accident_data_foldername, 'ongevallen.txt'), 'ongevallen', chunksize, None,
+                                              keep_changed_accidents).set_index('VKL_NUMMER')
+        accident_hashes = pd.concat(accident_hashes) if accident_hashes else pd.Series(dtype='uint64')
+        accident_hashes = accident_hashes[~accident_hashes.index.duplicated()]
+
+        party_hashes = []
+        def keep_parties_of_changed_accidents(chunk):
+            chunk = chunk[chunk['VKL_NUMMER'].isin(accident_hashes.index)]
+            party_hashes.append(pd.DataFrame({'VKL_NUMMER': chunk['VKL_NUMMER'].to_numpy(), 'hash': row_hashes(chunk.set_index('PTJ_ID')).to_numpy()}))
+            return chunk[chunk['VKL_NUMMER'].isin(changed_accidents.index)]
+        partijen_filename = Path(foldername, accident_data_foldername, 'partijen.txt')
+        changed_parties = read_csv_filtered(partijen_filename, 'partijen', chunksize, None, keep_parties_of_changed_accidents)
+        parties_hashes = combine_party_hashes(pd.concat(party_hashes) if party_hashes else pd.DataFrame({'VKL_NUMMER': [], 'hash': []}), accident_hashes.index)
+
+        #Accidents of which only the parties changed, their parties are read in a second pass
+        parties_changed = accident_hashes.index[(parties_hashes.to_numpy() != stored['parties_hash'].reindex(accident_hashes.index, fill_value=0).to_numpy())
+                                                & ~accident_hashes.index.isin(changed_accidents.index)]
+        if len(parties_changed) > 0:
+            extra_parties = read_csv_filtered(partijen_filename, 'partijen', chunksize, None, lambda chunk: chunk[chunk['VKL_NUMMER'].isin(parties_changed)])
+            changed_parties = concat_chunks([changed_parties, extra_parties])
+        changed_parties = changed_parties.set_index('PTJ_ID')
+
+        location = pd.concat([changed_accidents[['WVK_ID', 'HECTOMETER']], stored.loc[parties_changed, ['WVK_ID', 'HECTOMETER']]])
+        reassessment = assess_accidents(location, changed_parties, reference_tables)
+        reassessment = location.join(reassessment)
+        reassessment['accident_hash'] = accident_hashes.reindex(reassessment.index).to_numpy()
+        reassessment['parties_hash'] = parties_hashes.reindex(reassessment.index).to_numpy()
+
+        removed = stored.index[~stored.index.isin(accident_hashes.index)]
+        replaced = stored.index[stored.index.isin(reassessment.index)]
+        affected_segments = pd.concat([stored.loc[removed.append(replaced), 'WVK_ID'], reassessment['WVK_ID']]).dropna().unique()
+        summary = {'new': len(reassessment) - len(replaced), 'changed': len(replaced), 'removed': len(removed),
+                   'unchanged': len(accident_hashes) - len(reassessment)}
+        if self.assessment is None:
+            self.assessment = reassessment
+        else:
+            self.assessment = pd.concat([self.assessment.drop(removed.append(replaced)), reassessment])
+        self.assessment = self.assessment.astype({'accident_hash': 'uint64', 'parties_hash': 'uint64'})
+
+        self.update_aggregates(foldername, chunksize, affected_segments)
+        return summary
+
+    def update_aggregates(self, foldername, chunksize, affected_segments):
+        """Updates the per-segment aggregates for the affected road segments and for road segments whose WEGNUMMER or RIJRICHTNG changed"""
+        wegvakken = read_csv_filtered(Path(foldername, network_data_foldername, 'wegvakken.txt'), 'wegvakken', chunksize, ['WVK_ID', 'WEGNUMMER', 'RIJRICHTNG'],
+                                      lambda chunk: chunk[chunk['WEGNUMMER'].notna()])
+        segments = wegvakken.drop_duplicates('WVK_ID').set_index('WVK_ID')[['WEGNUMMER', 'RIJRICHTNG']].astype(object)
+        if self.segments is None or self.aggregates is None:
+            affected_segments = segments.index
+        else:
+            previous_segments = self.segments.reindex(segments.index)
+            changed_segments = segments.index[(segments.fillna('') != previous_segments.fillna('')).any(axis=1)]
+            removed_segments = self.segments.index[~self.segments.index.isin(segments.index)]
+            affected_segments = pd.Index(affected_segments).append(changed_segments).append(removed_segments).unique()
+        self.segments = segments
+        accidents_assessed = self.assessment[self.assessment['WVK_ID'].isin(affected_segments)]
+        updated_aggregates = aggregate_segments(accidents_assessed[['WVK_ID', 'HECTOMETER', 'expected_damage_level']], segments[segments.index.isin(affected_segments)])
+        if self.aggregates is None:
+            self.aggregates = updated_aggregates
+        else:
+            self.aggregates = pd.concat([self.aggregates.drop(self.aggregates.index.intersection(affected_segments)), updated_aggregates])
+
+def combine_party_hashes(party_hashes, accident_IDs):
+    """Helper function that combines the hashes of all parties of an accident into one order-independent hash (sum modulo 2**64)"""
+    party_hashes = party_hashes.sort_values('VKL_NUMMER', kind='stable')
+    accident_keys = party_hashes['VKL_NUMMER'].to_numpy()
+    hashes = party_hashes['hash'].to_numpy(dtype='uint64')
+    if len(accident_keys) == 0:
+        return pd.Series(np.zeros(len(accident_IDs), dtype='uint64'), index=accident_IDs)
+    starts = np.flatnonzero(np.r_[True, accident_keys[1:] != accident_keys[:-1]])
+    sums = pd.Series(np.add.reduceat(hashes, starts), index=accident_keys[starts])
+    return sums.reindex(accident_IDs, fill_value=0).astype('uint64')
+
+
+###### REPORT EXPORT ######
+
+
+#Fields of the accidents that are included in the report, next to the abstractions and the expected damage level
+report_accident_fields = ['REGNUMMER', 'JAAR_VKL', 'MND_NUMMER', 'DATUM_VKL', 'AP3_CODE', 'WVK_ID', 'HECTOMETER']
+#Fields of the road segment that are added to every accident in the report
+report_roadsegment_fields = ['WEGNUMMER', 'RIJRICHTNG']
+#Descriptions of the fields that are computed by HIP, the BRON fields are described by load_fields_descriptions
+report_field_descriptions = {
+    'n_parties': 'Number of parties involved in the accident',
+    'happend_on_highway': 'Abstraction: the accident happend on the highway',
+    'involves_element_from_road': 'Abstraction: one of the parties is an element from the road (tree, lamppost, road furniture, ...)',
+    'involves_heavy_object': 'Abstraction: one of the parties is a heavy object (truck, tractor, ...)',
+    'involves_damaging_movement': 'Abstraction: one of the parties made a damaging movement (tilting, overturning, rolling out)',
+    'scale_accident': 'Abstraction: scale of the accident based on the number of parties (small, medium, large)',
+    'involves_heavy_object_and_road_element': 'Abstraction: the accident involves both a heavy object and an element from the road',
+    'expected_damage_level': 'Result of the assesment task: expected damage level of the highway (high, medium, undecided)',
+    'n_accidents': 'Number of accidents on the road segment',
+    'n_high': 'Number of accidents on the road segment with a high expected damage level',
+    'n_medium': 'Number of accidents on the road segment with a medium expected damage level',
+    'n_undecided': 'Number of accidents on the road segment with an undecided expected damage level',
+    'expected_damage': 'Aggregated expected damage of the road segment, weighted with damage_level_weights',
+    'HECTOMETER': 'Hectometre of the accident, for road segments the median hectometre of its accidents'}
+report_formats = {'csv': '.csv', 'parquet': '.parquet', 'jsonl': '.jsonl'}
+
+def export_report(data, foldername, file_format='csv', fields_descriptions=None, assessment=None, aggregates=None, accident_fields=None,
+                  chunksize=100000, n_processes=None):
+    """This function exports the results of the assesment for the whole network, e.g. for the weekly report to the contractor:
+        - accidents: one row per accident with the report_accident_fields (or accident_fields), the road of its road segment,
+          the abstractions and the expected damage level
+        - segments: one row per road segment with the aggregated expected damage (see segment_aggregates)
+       The file_format is 'csv', 'parquet' or 'jsonl' (JSON Lines). The rows are written in chunks of chunksize rows,
+       so no complete copy of the report is made in memory.
+
+       If fields_descriptions (the result of load_fields_descriptions) is given, the descriptions of the columns are stored
+       as metadata: inside the Parquet schema, or in a <name>.metadata.json file next to the CSV and JSON Lines files.
+       The assessment and aggregates are computed if they are not given. Returns the filenames of the exported files."""
+    if file_format not in report_formats:
+        raise ValueError(f'Unknown file format {file_format}, use one of {list(report_formats)}')
+    data = prepare_data(data)
+    accidents, parties, roadsegments, ref_files = data
+    if assessment is None:
+        assessment = assess_all(data, n_processes)
+    if aggregates is None:
+        aggregates = segment_aggregates(data, assessment, n_processes)
+    if accident_fields is None:
+        accident_fields = [field for field in report_accident_fields if field in accidents.columns]
+    assessment = assessment.reindex(accidents.index) if not assessment.index.equals(accidents.index) else assessment
+    roads = roadsegments.drop_duplicates('WVK_ID').set_index('WVK_ID')[report_roadsegment_fields]
+    descriptions = report_descriptions(fields_descriptions)
+
+    Path(foldername).mkdir(parents=True, exist_ok=True)
+    filenames = {}
+    writer = ReportWriter(Path(foldername, 'accidents'+report_formats[file_format]), file_format, descriptions)
+    for start in range(0, len(accidents), chunksize):
+        chunk = accidents.iloc[start:start+chunksize]
+        chunk_roads = roads.reindex(chunk['WVK_ID'].to_numpy()) if 'WVK_ID' in chunk else pd.DataFrame(index=range(len(chunk)))
+        report = pd.concat([pd.DataFrame({'VKL_NUMMER': chunk.index.to_numpy()}),
+                            chunk[accident_fields].reset_index(drop=True),
+                            chunk_roads.reset_index(drop=True),
+                            assessment.iloc[start:start+chunksize].reset_index(drop=True)], axis=1)
+        writer.write(report)
+    filenames['accidents'] = writer.close()
+
+    writer = ReportWriter(Path(foldername, 'segments'+report_formats[file_format]), file_format, descriptions)
+    for start in range(0, len(aggregates), chunksize):
+        writer.write(aggregates.iloc[start:start+chunksize].reset_index())
+    filenames['segments'] = writer.close()
+    return filenames
+
+def report_descriptions(fields_descriptions=None):
+    """Helper function that combines the descriptions of the BRON fields (from load_fields_descriptions) with those of the HIP fields"""
+    descriptions = {}
+    if fields_descriptions is not None:
+        dict_descriptions_accidents, dict_descriptions_roadsegments, dict_descriptions_parties = fields_descriptions
+        descriptions.update(dict_descriptions_roadsegments)
+        descriptions.update(dict_descriptions_accidents)
+    descriptions.update(report_field_descriptions)
+    return descriptions
+
+class ReportWriter():
+    """Writes a report in chunks to a CSV, Parquet or JSON Lines file. 
+       The first chunk determines the columns and types, text columns are written as strings"""
+    def __init__(self, filename, file_format, descriptions):
+        self.filename = Path(filename)
+        self.file_format = file_format
+        self.descriptions = descriptions
+        self.columns = None
+        self.parquet_writer = None
+        self.n_rows = 0
+
+    def write(self, chunk):
+        chunk = normalize_report_chunk(chunk)
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+            self.dtypes = chunk.dtypes
+        else:
+            chunk = chunk[self.columns].astype(self.dtypes)
+        if self.file_format == 'csv':
+            chunk.to_csv(self.filename, index=False, mode='w' if self.n_rows == 0 else 'a', header=self.n_rows == 0)
+        elif self.file_format == 'jsonl':
+            with open(self.filename, 'w' if self.n_rows == 0 else 'a', encoding='utf-8') as f:
+                f.write(chunk.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n') + '\n')
+        elif self.file_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self.parquet_writer is None:
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                fields = [field.with_metadata({'description': self.descriptions[field.name]}) if field.name in self.descriptions else field for field in schema]
+                self.schema = pa.schema(fields, metadata=schema.metadata)
+                self.parquet_writer = pq.ParquetWriter(self.filename, self.schema)
+            self.parquet_writer.write_table(pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False))
+        self.n_rows += len(chunk)
+
+    def close(self):
+        """Finishes the file, also when no rows were written, and writes the metadata file for CSV and JSON Lines"""
+        if self.columns is None:
+            self.columns = []
+            self.dtypes = pd.Series(dtype=object)
+            if self.file_format == 'parquet':
+                pd.DataFrame().to_parquet(self.filename, engine='pyarrow')
+            else:
+                self.filename.write_text('', encoding='utf-8')
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        if self.file_format != 'parquet':
+            metadata = {'rows': self.n_rows, 'columns': [{'name': column, 'dtype': str(self.dtypes[column]), 'description': self.descriptions.get(column)}
+                                                          for column in self.columns]}
+            with open(self.filename.with_suffix('.metadata.json'), 'w', encoding='utf-8') as f:
+                json.dump(metadata, f, indent=2, ensure_ascii=False)
+        return self.filename
+
+def normalize_report_chunk(chunk):
+    """Helper function that converts text and categorical columns to strings, so every chunk of a report has the same types"""
+    chunk = chunk.copy()
+    for column in chunk.columns:
+        if chunk[column].dtype == object or isinstance(chunk[column].dtype, pd.CategoricalDtype):
+            chunk[column] = chunk[column].astype('string')
+    return chunk
+
+
+###### COMMAND LINE ######
+
+def main(arguments=None):
+    """Command line entry point for batch jobs: imports the BRON data, assesses all accidents, aggregates the road segments
+       and exports the report (see export_report), without plotting or printing. The duration of every step is printed.
+
+       Usage: python highway_inspection_planning.py foldername report_foldername --format parquet --processes 4"""
+    parser = argparse.ArgumentParser(description='Assess all BRON highway accidents and export the report')
+    parser.add_argument('foldername', help='folder with the BRON export')
+    parser.add_argument('report_foldername', help='folder to write the report to')
+    parser.add_argument('--format', default='csv', choices=list(report_formats), help='file format of the report')
+    parser.add_argument('--cache', help='folder of the columnar cache, see import_data_cached')
+    parser.add_argument('--chunksize', type=int, help='import the data in chunks of this many rows, see import_data_streaming')
+    parser.add_argument('--processes', type=int, help='number of processes for the assessment and aggregation')
+    parser.add_argument('--descriptions', help='xlsx file with the field descriptions, stored as column metadata of the report')
+    parser.add_argument('--profile', help='enable the profiler and export its summary to this json file')
+    arguments = parser.parse_args(arguments)
+
+    if arguments.profile:
+        profiler.enable()
+    timings = []
+    def timed(step, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        timings.append((step, time.perf_counter() - start))
+        print(f'{step}: {timings[-1][1]:.2f} s', flush=True)
+        return result
+
+    if arguments.cache:
+        data = timed('import_data', import_data_cached, arguments.foldername, arguments.cache)
+    else:
+        data = timed('import_data', import_data, arguments.foldername, chunksize=arguments.chunksize)
+    data = prepare_data(data)
+    fields_descriptions = load_fields_descriptions(arguments.descriptions) if arguments.descriptions else None
+    assessment = timed('assess_all', assess_all, data, arguments.processes)
+    aggregates = timed('segment_aggregates', segment_aggregates, data, assessment, arguments.processes)
+    filenames = timed('export_report', export_report, data, arguments.report_foldername, arguments.format, fields_descriptions,
+                      assessment, aggregates)
+    print(f'total: {sum(seconds for step, seconds in timings):.2f} s for {len(data[0])} accidents and {len(aggregates)} road segments')
+    for filename in filenames.values():
+        print(f'   - {filename}')
+    if arguments.profile:
+        profiler.export(arguments.profile)
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,309 @@
+"""Resident query service for HIP.
+
+Every script that uses HIP pays the import of the BRON data before it can do a single lookup. This service
+imports the data once, builds the lookup indexes, assesses all accidents and builds the aggregation cube,
+and then answers queries over a local socket (a Unix socket or TCP on localhost):
+    - retrieve_accident_by_ID, find_parties: an accident with its parties, road segment and assessment
+    - retrieve_road_segment_by_ID, find_road_segment, find_accidents_on_roadsegment: road segments and their accidents
+    - assessment, segment_aggregates, rollup: the expected damage levels, the aggregates per road segment and roll-ups of the cube
+    - find_accidents_within_radius, find_nearest_junctions: spatial queries
+
+The protocol is JSON Lines: every request is one line {"id": 1, "method": "find_road_segment", "params": {"roadsegment_ID": 123}}
+and is answered with one line {"id": 1, "result": ...} or {"id": 1, "error": {"type": "KeyError", "message": ...}}.
+A line can also hold a list of requests, which is answered with a list of responses. All complete lines that arrive
+together on a connection are handled as one batch and their responses are written at once.
+
+HIPClient is a thin client with the same functions as the module, without the data argument.
+
+Usage:
+    python hip_service.py "BRON" --cache bron_cache --socket /tmp/hip.sock
+    python hip_service.py "BRON" --port 8765
+
+    client = HIPClient('/tmp/hip.sock')
+    accident = client.retrieve_accident_by_ID(accident_ID)
+    accidents = client.batch([('retrieve_accident_by_ID', {'accident_ID': ID}) for ID in accident_IDs])"""
+import argparse
+import asyncio
+import builtins
+import json
+import socket
+import time
+import numpy as np
+import pandas as pd
+
+import highway_inspection_planning as HIP
+
+default_host = '127.0.0.1'
+#Number of bytes read from a connection at once, all complete requests in it are handled as one batch
+read_size = 2**16
+#Exceptions that are raised with the same type in the client, other exceptions are raised as HIPServiceError
+client_exceptions = ['KeyError', 'ValueError', 'TypeError', 'IndexError']
+
+class HIPServiceError(Exception):
+    """Error raised by the client when a query failed in the service"""
+
+class HIPService():
+    """Keeps the data, the indexes, the assessment and the aggregation cube in memory and answers the queries.
+       Every method_<name> can be called by clients as <name>, the results are converted to JSON compatible values"""
+    def __init__(self, data, assessment=None, n_processes=None):
+        self.data = HIP.prepare_data(data)
+        self.data.build_indexes()
+        self.assessment = assessment if assessment is not None else HIP.assess_all(self.data, n_processes)
+        self.cube = HIP.AggregateCube.from_data(self.data, self.assessment)
+        self.aggregates = HIP.segment_aggregates(self.data, cube=self.cube)
+        self.assessment_rows = RowLookup(self.assessment)
+        self.aggregates_rows = RowLookup(self.aggregates)
+        self.n_requests = 0
+        self.started = time.time()
+
+    @classmethod
+    def from_folder(cls, foldername, cache_foldername=None, n_processes=None):
+        """Imports the BRON data in foldername, through the columnar cache if a cache folder is given"""
+        if cache_foldername:
+            data = HIP.import_data_cached(foldername, cache_foldername)
+        else:
+            data = HIP.import_data(foldername)
+        return cls(data, n_processes=n_processes)
+
+    def handle(self, request):
+        """Handles one request dictionary and returns the response dictionary"""
+        self.n_requests += 1
+        request_ID = request.get('id') if isinstance(request, dict) else None
+        try:
+            method = getattr(self, 'method_' + str(request['method']), None)
+            if method is None:
+                raise ValueError(f"Unknown method {request['method']}")
+            return {'id': request_ID, 'result': method(**request.get('params', {}))}
+        except Exception as error:
+            return {'id': request_ID, 'error': {'type': type(error).__name__, 'message': str(error)}}
+
+    def handle_line(self, line):
+        """Handles one line of the protocol, which holds one request or a list of requests"""
+        try:
+            message = json.loads(line)
+        except ValueError as error:
+            return encode({'id': None, 'error': {'type': 'ValueError', 'message': f'Invalid request: {error}'}})
+        if isinstance(message, list):
+            return encode([self.handle(request) for request in message])
+        return encode(self.handle(message))
+
+    async def handle_connection(self, reader, writer):
+        """Reads the requests of one connection and writes the responses per batch of lines"""
+        buffer = b''
+        try:
+            while True:
+                received = await reader.read(read_size)
+                if not received:
+                    break
+                *lines, buffer = (buffer + received).split(b'\n')
+                responses = [self.handle_line(line) for line in lines if line.strip()]
+                if responses:
+                    writer.write(b''.join(responses))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=None, host=default_host, port=None):
+        """Serves the queries on the Unix socket socket_path, or on TCP host:port, until the task is cancelled"""
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=host, port=port)
+        async with server:
+            await server.serve_forever()
+
+    def method_ping(self):
+        return {'n_requests': self.n_requests, 'uptime': time.time() - self.started}
+
+    def method_retrieve_accident_by_ID(self, accident_ID):
+        accident = HIP.retrieve_accident_by_ID(self.data, accident_ID)
+        return {'ID': accident.ID, 'accident': accident.accident, 'roadsegment': accident.roadsegment, 'parties': accident.parties,
+                'n_parties': accident.n_parties, 'registrationnumber': accident.registrationnumber,
+                'assessment': self.assessment_row(accident_ID)}
+
+    def method_find_parties(self, accident_ID):
+        return HIP.find_parties(self.data, accident_ID)
+
+    def method_retrieve_road_segment_by_ID(self, roadsegment_ID, n_accidents=None):
+        roadsegment = HIP.find_road_segment(self.data, roadsegment_ID)
+        query = HIP.query_accidents_on_roadsegment(self.data, roadsegment_ID)
+        return {'ID': roadsegment_ID, 'roadsegment': roadsegment, 'n_accidents': len(query),
+                'accidents': records(query.fetch(n_accidents)), 'aggregates': self.aggregates_row(roadsegment_ID)}
+
+    def method_find_road_segment(self, roadsegment_ID):
+        return HIP.find_road_segment(self.data, roadsegment_ID)
+
+    def method_find_accidents_on_roadsegment(self, roadsegment_ID, start_year=None, end_year=None, start_date=None, end_date=None,
+                                             n_accidents=None, page=0):
+        query = HIP.query_accidents_on_roadsegment(self.data, roadsegment_ID, start_year, end_year, start_date, end_date)
+        return records(query.page(page, n_accidents))
+
+    def method_assessment(self, accident_ID):
+        return self.assessment_row(accident_ID)
+
+    def method_segment_aggregates(self, roadsegment_ID=None):
+        if roadsegment_ID is None:
+            return records(self.aggregates)
+        return self.aggregates_row(roadsegment_ID)
+
+    def method_rollup(self, dimensions=(), measure='n_accidents', filters=None):
+        rollup = self.cube.rollup(list(dimensions), measure, filters)
+        if not isinstance(rollup, pd.Series):
+            return rollup
+        return [list(key) + [value] if isinstance(key, tuple) else [key, value] for key, value in rollup.items()]
+
+    def method_find_accidents_within_radius(self, x, y, radius, since_year=None):
+        return records(HIP.find_accidents_within_radius(self.data, x, y, radius, since_year))
+
+    def method_find_nearest_junctions(self, x, y, k=1):
+        return records(HIP.find_nearest_junctions(self.data, x, y, k))
+
+    def assessment_row(self, accident_ID):
+        """Helper function that returns the assessment of an accident as dictionary"""
+        return self.assessment_rows.get(accident_ID)
+
+    def aggregates_row(self, roadsegment_ID):
+        """Helper function that returns the aggregates of a road segment as dictionary, or None if no accidents happend on it"""
+        if roadsegment_ID not in self.aggregates_rows:
+            return None
+        return dict(self.aggregates_rows.get(roadsegment_ID), WVK_ID=roadsegment_ID)
+
+class RowLookup():
+    """Maps the index values of a dataframe to its rows as dictionaries, without selecting rows from the dataframe.
+       If an index value occurs more than once, the last row is returned"""
+    def __init__(self, frame):
+        self.positions = dict(zip(frame.index.tolist(), range(len(frame))))
+        self.columns = list(frame.columns)
+        self.arrays = [frame[column].to_numpy() for column in frame.columns]
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def get(self, key):
+        position = self.positions[key]
+        return {column: HIP.python_value(array[position]) for column, array in zip(self.columns, self.arrays)}
+
+class HIPClient():
+    """Thin client for the HIP service. The functions mirror the functions of the module, without the data argument,
+       but the results are plain dictionaries and lists instead of Accident/Roadsegment objects and dataframes.
+       The address is the path of a Unix socket or a (host, port) tuple"""
+    def __init__(self, address):
+        if isinstance(address, (tuple, list)):
+            self.socket = socket.create_connection(tuple(address))
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+        self.file = self.socket.makefile('rb')
+        self.request_ID = 0
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def call(self, method, **params):
+        """Sends one request and returns its result"""
+        return self.batch([(method, params)])[0]
+
+    def batch(self, calls):
+        """Sends a list of (method, params) tuples as one request and returns the list of results.
+           If one of the calls failed, its error is raised"""
+        requests = []
+        for method, params in calls:
+            self.request_ID += 1
+            requests.append({'id': self.request_ID, 'method': method, 'params': params})
+        self.socket.sendall(encode(requests))
+        responses = json.loads(self.file.readline())
+        for response in responses:
+            if 'error' in response:
+                raise client_error(response['error'])
+        return [response['result'] for response in responses]
+
+    def ping(self):
+        return self.call('ping')
+
+    def retrieve_accident_by_ID(self, accident_ID):
+        return self.call('retrieve_accident_by_ID', accident_ID=accident_ID)
+
+    def find_parties(self, accident_ID):
+        return self.call('find_parties', accident_ID=accident_ID)
+
+    def retrieve_road_segment_by_ID(self, roadsegment_ID, n_accidents=None):
+        return self.call('retrieve_road_segment_by_ID', roadsegment_ID=roadsegment_ID, n_accidents=n_accidents)
+
+    def find_road_segment(self, roadsegment_ID):
+        return self.call('find_road_segment', roadsegment_ID=roadsegment_ID)
+
+    def find_accidents_on_roadsegment(self, roadsegment_ID, start_year=None, end_year=None, start_date=None, end_date=None, n_accidents=None, page=0):
+        return self.call('find_accidents_on_roadsegment', roadsegment_ID=roadsegment_ID, start_year=start_year, end_year=end_year,
+                         start_date=start_date, end_date=end_date, n_accidents=n_accidents, page=page)
+
+    def assessment(self, accident_ID):
+        return self.call('assessment', accident_ID=accident_ID)
+
+    def segment_aggregates(self, roadsegment_ID=None):
+        return self.call('segment_aggregates', roadsegment_ID=roadsegment_ID)
+
+    def rollup(self, dimensions=(), measure='n_accidents', filters=None):
+        return self.call('rollup', dimensions=list(dimensions), measure=measure, filters=filters)
+
+    def find_accidents_within_radius(self, x, y, radius, since_year=None):
+        return self.call('find_accidents_within_radius', x=x, y=y, radius=radius, since_year=since_year)
+
+    def find_nearest_junctions(self, x, y, k=1):
+        return self.call('find_nearest_junctions', x=x, y=y, k=k)
+
+def client_error(error):
+    """Helper function that converts an error response to the exception raised by the client"""
+    if error['type'] in client_exceptions:
+        return getattr(builtins, error['type'])(error['message'])
+    return HIPServiceError(f"{error['type']}: {error['message']}")
+
+def records(frame):
+    """Helper function that converts a dataframe to a list of row dictionaries, including the index if it has a name"""
+    return (frame.reset_index() if frame.index.name else frame).to_dict(orient='records')
+
+def json_value(value):
+    """Helper function for json.dumps that converts the values that are not supported by JSON (numpy values, timestamps, pd.NA)"""
+    if isinstance(value, np.generic):
+        return HIP.python_value(value)
+    if isinstance(value, (pd.Timestamp, pd.Timedelta)):
+        return value.isoformat()
+    if value is pd.NA or value is pd.NaT:
+        return None
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':'), default=json_value).encode() + b'\n'
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Resident HIP query service')
+    parser.add_argument('foldername', help='folder with the BRON export')
+    parser.add_argument('--cache', help='folder of the columnar cache, see HIP.import_data_cached')
+    parser.add_argument('--socket', help='path of the Unix socket to listen on')
+    parser.add_argument('--host', default=default_host)
+    parser.add_argument('--port', type=int, help='TCP port to listen on, if no Unix socket is given')
+    parser.add_argument('--processes', type=int, help='number of processes for the assessment at startup')
+    arguments = parser.parse_args(arguments)
+    if not arguments.socket and not arguments.port:
+        parser.error('either --socket or --port is required')
+
+    start = time.perf_counter()
+    service = HIPService.from_folder(arguments.foldername, arguments.cache, arguments.processes)
+    print(f'Data loaded and assessed in {time.perf_counter() - start:.1f} s, serving on {arguments.socket or f"{arguments.host}:{arguments.port}"}')
+    try:
+        asyncio.run(service.serve(arguments.socket, arguments.host, arguments.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())